@@ -1,17 +1,25 @@
 # GameEngine.py
 import json
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import ollama
 from pydantic import ValidationError
 import os
 from datetime import datetime
 from config import Config
-from models import ScenarioInvestigativo
+from models import ScenarioInvestigativo, ScheletroCaso, DettagliSospettato, Sospettato
 from GestoreMemoria import MemoriaRAG
 from KnowledgeGraph import KnowledgeGraph
+from TrasportoOllama import trasporto
 import webbrowser
 
+
+class RispostaFuoriPersonaggio(RuntimeError):
+    """Sollevata quando anche il secondo tentativo di generazione esce dal personaggio."""
+
+
 class GameEngine:
     """
     Classe principale (Controller) che orchestra l'intera logica del sistema investigativo.
@@ -28,68 +36,184 @@ class GameEngine:
         self.kg = None  # Istanza del Knowledge Graph (Verità Oggettiva / Ground Truth)
         self.memorie = {}  # Dizionario che mappa ID sospettato -> Istanza MemoriaRAG (Vector Store)
 
+        # Memoria a Breve Termine: Chat History reale (messaggi user/assistant) per ogni sospettato
+        self.storie_chat = {}
+        # Cache dei System Prompt (la 'Persona' non cambia durante la partita)
+        self._system_prompts = {}
+        # Ultima lista di messaggi inviata per ogni sospettato (serve a misurare il prefisso riusato)
+        self._ultimi_messaggi = {}
+        # Statistiche di prefill per turno, per ogni sospettato
+        self.statistiche_prefill = {}
+        # Taratura della stima dei token: sospettato -> token reali per token stimato (dalla prima chiamata)
+        self._taratura_prefill = {}
+        # Contatori del Fact-Checking Loop (usati anche dalla simulazione headless)
+        self.metriche = {'verifiche': 0, 'correzioni': 0, 'fallback_ai': 0, 'interruzioni': 0,
+                         'risposte_ripiego': 0, 'verifiche_saltate': 0, 'correzioni_saltate': 0}
+        # Protegge contatori e metriche quando più sospettati vengono interrogati in parallelo
+        self._lock_stato = threading.Lock()
+
         # Variabili per la gestione della progressione temporale e narrativa
         self.turni_giocati = 0
         self.evento_avvenuto = False  # Flag per garantire che il colpo di scena avvenga una sola volta
+        # Colpo di scena generato in anticipo (thread + risultato in preparazione)
+        self._prefetch_colpo_scena = None
+        self._lock_colpo_scena = threading.Lock()
 
         # Verifica e creazione della directory per la persistenza dei dati
         if not os.path.exists(Config.SAVES_DIR):
             os.makedirs(Config.SAVES_DIR)
 
-    def genera_nuova_partita(self):
+    def genera_nuova_partita(self, num_sospettati=None):
         """
         Genera un nuovo scenario investigativo completo utilizzando la tecnica del 'Template Prompting'.
-        Costringe l'LLM a produrre un output JSON conforme allo schema Pydantic 'ScenarioInvestigativo'.
-        Include un meccanismo di 'Self-Correction' (fino a 3 tentativi) in caso di JSON malformato.
+        La generazione è divisa in due fasi, per scalare a casi con molti sospettati:
+        1. Scheletro: una chiamata breve produce vittima, arma, movente, prove, cast e colpevole.
+        2. Sub-Generation: i dettagli di ogni sospettato vengono generati in parallelo e validati
+           singolarmente contro lo Scheletro.
+        Ogni output JSON è validato con Pydantic, con 'Self-Correction' (fino a 3 tentativi) per ogni chiamata.
         """
+        num_sospettati = num_sospettati or Config.NUM_SOSPETTATI
+        if not Config.MIN_SOSPETTATI <= num_sospettati <= Config.MAX_SOSPETTATI:
+            print(f"Numero di sospettati non valido ({Config.MIN_SOSPETTATI}-{Config.MAX_SOSPETTATI}).")
+            return False
+
         print("Generazione Scenario in corso...")
 
+        # 1. Scheletro del caso
+        scheletro = self._genera_scheletro(num_sospettati)
+        if scheletro is None:
+            return False
+
+        # 2. Dettagli dei sospettati in parallelo (il tempo totale resta vicino a quello di una singola chiamata)
+        with ThreadPoolExecutor(max_workers=min(num_sospettati, Config.MAX_GENERAZIONI_PARALLELE)) as pool:
+            sospettati = list(pool.map(lambda i: self._genera_sospettato(scheletro, i), range(num_sospettati)))
+        if any(s is None for s in sospettati):
+            return False
+
+        try:
+            obj = ScenarioInvestigativo(
+                **scheletro.model_dump(exclude={'cast', 'indice_colpevole'}),
+                sospettati=sospettati
+            )
+        except ValidationError as e:
+            print(f"Errore validazione: {e}")
+            return False
+
+        # Inizializzazione delle strutture dati di gioco
+        self.inizializza_dati(obj.model_dump())
+        return True
+
+    def _genera_json(self, prompt, modello, verifica=None):
+        """
+        Chiamata all'LLM in modalità JSON con validazione Pydantic e 'Self-Correction' (fino a 3 tentativi).
+        :param verifica: funzione opzionale per controlli aggiuntivi sull'oggetto validato (solleva ValueError).
+        """
+        # Ciclo di retry per gestire eventuali errori di generazione del JSON
+        for _ in range(3):
+            try:
+                # Chiamata all'LLM locale (Ollama)
+                res = trasporto.chat(
+                    model=Config.MODEL_NAME,
+                    messages=[{'role': 'user', 'content': prompt}],
+                    format='json',  # Forza la modalità JSON di Llama
+                    options={'temperature': Config.TEMPERATURE_CREATIVA},
+                    keep_alive=Config.KEEP_ALIVE
+                )
+                # Validazione dei dati tramite Pydantic: se il JSON non rispetta lo schema, solleva ValidationError
+                obj = modello.model_validate_json(res['message']['content'])
+                if verifica:
+                    verifica(obj)
+                return obj
+            except ValidationError as e:
+                print(f"Errore validazione: {e}")
+            except Exception as e:
+                print(f"Errore generazione: {e}")
+        return None
+
+    def _genera_scheletro(self, num_sospettati):
+        """Fase 1: genera i fatti globali del caso, il cast dei sospettati e la scelta del colpevole."""
         # Prompt Engineering: Definizione rigorosa della struttura dati attesa
-        prompt = """
+        prompt = f"""
         Sei un game designer di gialli procedurali.
         Genera un JSON seguendo ESATTAMENTE questa struttura:
-        {
+        {{
             "vittima": "Nome Cognome",
             "luogo_omicidio": "Descrizione noir",
             "arma_reale": "Oggetto",
             "movente_reale": "Motivo",
             "intro_atmosfera": "Meteo e luci",
             "rapporto_forense": ["Scrivi: Ora del decesso: (indica orario)", "Scrivi: Ora del ritrovamento del corpo: (indica orario che deve essere successivo all'ora del decesso", "Rapporto della scientifica"],
-            "sospettati": [
-                { "id": 0, "nome": "...", "ruolo": "...", "colpevole": true, "personalita": ""personalita": "Aggettivo forte che definisce come parla (es. Balbuziente, Arrogante, Logorroico, Timido)",", "alibi": "Falso...", "segreto": "...", "indizio_iniziale": "..." },
-                { "id": 1, "nome": "...", "ruolo": "...", "colpevole": false, "personalita": ""personalita": "Aggettivo forte che definisce come parla (es. Balbuziente, Arrogante, Logorroico, Timido)",", "alibi": "Vero...", "segreto": "...", "indizio_iniziale": "..." },
-                { "id": 2, "nome": "...", "ruolo": "...", "colpevole": false, "personalita": ""personalita": "Aggettivo forte che definisce come parla (es. Balbuziente, Arrogante, Logorroico, Timido)",", "alibi": "Vero...", "segreto": "...", "indizio_iniziale": "..." }
-            ]
-        }
+            "cast": [ {{ "nome": "...", "ruolo": "..." }}, ... ],
+            "indice_colpevole": 0
+        }}
         Rispondi SOLO col JSON.
         IMPORTANTE: 
         - Assicurati di chiudere tutte le parentesi graffe e quadre. Usa doppi apici.
-        - L'indizio_iniziale deve dare al detective un motivo valido per sospettare di loro.
+        - Il "cast" deve contenere ESATTAMENTE {num_sospettati} sospettati.
+        - "indice_colpevole" è la posizione dell'assassino nel cast (da 0 a {num_sospettati - 1}): il movente deve essere il suo.
         REGOLE:
         - I nomi dei sospettati devono essere TUTTI diversi tra loro e DIVERSI dalla vittima.
         - Usa nomi e cognomi inglesi vari.
         """
 
-        # Ciclo di retry per gestire eventuali errori di generazione del JSON
-        for _ in range(3):
-            try:
-                # Chiamata all'LLM locale (Ollama)
-                res = ollama.chat(
-                    model=Config.MODEL_NAME,
-                    messages=[{'role': 'user', 'content': prompt}],
-                    format='json',  # Forza la modalità JSON di Llama
-                    options={'temperature': Config.TEMPERATURE_CREATIVA}
-                )
-                # Validazione dei dati tramite Pydantic: se il JSON non rispetta lo schema, solleva ValidationError
-                obj = ScenarioInvestigativo.model_validate_json(res['message']['content'])
-                # Inizializzazione delle strutture dati di gioco
-                self.inizializza_dati(obj.model_dump())
-                return True
-            except ValidationError as e:
-                print(f"Errore validazione: {e}")
-            except Exception as e:
-                print(f"Errore generazione: {e}")
-        return False
+        def verifica(scheletro):
+            if len(scheletro.cast) != num_sospettati:
+                raise ValueError(f"Il cast contiene {len(scheletro.cast)} sospettati invece di {num_sospettati}")
+
+        return self._genera_json(prompt, ScheletroCaso, verifica)
+
+    def _genera_sospettato(self, scheletro, indice):
+        """
+        Fase 2: genera i dettagli narrativi di un singolo sospettato, coerenti con lo Scheletro.
+        Restituisce un oggetto 'Sospettato' (id, nome, ruolo e colpevolezza vengono dallo Scheletro) o None.
+        """
+        personaggio = scheletro.cast[indice]
+        colpevole = indice == scheletro.indice_colpevole
+        altri = ", ".join(p.nome for i, p in enumerate(scheletro.cast) if i != indice)
+
+        if colpevole:
+            ruolo_trama = f"""
+        È L'ASSASSINO. Ha ucciso {scheletro.vittima} con {scheletro.arma_reale}. Movente: {scheletro.movente_reale}.
+        - "alibi": un alibi FALSO ma credibile.
+        - "segreto": un dettaglio oscuro del suo passato.
+        - "indizio_iniziale": un indizio che lo collega al delitto senza provarlo."""
+        else:
+            ruolo_trama = f"""
+        È INNOCENTE.
+        - "alibi": un alibi VERO.
+        - "segreto": un segreto imbarazzante, estraneo all'omicidio, che lo rende sospetto.
+        - "indizio_iniziale": un motivo valido per sospettare di lui."""
+
+        prompt = f"""
+        Sei un game designer di gialli procedurali.
+        CASO: omicidio di {scheletro.vittima} a {scheletro.luogo_omicidio}.
+        FATTI NOTI: {", ".join(scheletro.rapporto_forense)}
+        ALTRI SOSPETTATI: {altri}
+
+        Crea il personaggio {personaggio.nome} ({personaggio.ruolo}).
+        {ruolo_trama}
+
+        Genera un JSON seguendo ESATTAMENTE questa struttura:
+        {{ "nome": "{personaggio.nome}", "personalita": "Aggettivo forte che definisce come parla (es. Balbuziente, Arrogante, Logorroico, Timido)", "alibi": "...", "segreto": "...", "indizio_iniziale": "..." }}
+        Rispondi SOLO col JSON. Il campo "nome" deve essere esattamente "{personaggio.nome}".
+        """
+
+        def verifica(dettagli):
+            # Validazione contro lo Scheletro: il personaggio generato deve essere quello richiesto
+            if dettagli.nome.strip().lower() != personaggio.nome.strip().lower():
+                raise ValueError(f"Nome '{dettagli.nome}' diverso da quello assegnato '{personaggio.nome}'")
+
+        dettagli = self._genera_json(prompt, DettagliSospettato, verifica)
+        if dettagli is None:
+            return None
+
+        return Sospettato(
+            id=indice,
+            nome=personaggio.nome,
+            ruolo=personaggio.ruolo,
+            colpevole=colpevole,
+            **dettagli.model_dump(exclude={'nome'})
+        )
 
     def genera_intro_narrativa(self):
         """
@@ -123,10 +247,11 @@ class GameEngine:
         """
 
         try:
-            res = ollama.chat(
+            res = trasporto.chat(
                 model=Config.MODEL_NAME,
                 messages=[{'role': 'user', 'content': prompt}],
-                options={'temperature': Config.TEMPERATURE_CREATIVA}  # Alta temperatura per maggiore creatività
+                options={'temperature': Config.TEMPERATURE_CREATIVA},  # Alta temperatura per maggiore creatività
+                keep_alive=Config.KEEP_ALIVE
             )
             return res['message']['content']
         except Exception as e:
@@ -141,6 +266,8 @@ class GameEngine:
         # Ripristino dello stato dei contatori (utile nel caricamento partite)
         self.turni_giocati = scenario_dict.get('turni_giocati', 0)
         self.evento_avvenuto = scenario_dict.get('evento_avvenuto', False)
+        # Un eventuale colpo di scena in preparazione appartiene alla partita precedente
+        self._prefetch_colpo_scena = None
 
         # 1. Costruzione del Knowledge Graph (Componente Simbolica)
         # Mappa le relazioni statiche tra sospettati, vittima e luoghi
@@ -151,8 +278,18 @@ class GameEngine:
         if self.evento_avvenuto and 'evento_testo' in self.scenario:
             self.kg.aggiungi_fatto(self.scenario['evento_testo'])
 
+        # Reset della memoria a breve termine e della cache dei prompt
+        self.storie_chat = {}
+        self._system_prompts = {}
+        self._ultimi_messaggi = {}
+        self.statistiche_prefill = {}
+        self._taratura_prefill = {}
+        self.metriche = {'verifiche': 0, 'correzioni': 0, 'fallback_ai': 0, 'interruzioni': 0,
+                         'risposte_ripiego': 0, 'verifiche_saltate': 0, 'correzioni_saltate': 0}
+
         # 2. Inizializzazione RAG (Retrieval-Augmented Generation)
         # Crea una collezione vettoriale separata per ogni sospettato
+        self.chiudi()
         self.memorie = {}
         for s in self.scenario['sospettati']:
             # Inizializza ChromaDB per questo specifico NPC
@@ -167,45 +304,190 @@ class GameEngine:
                 mem.aggiungi_memoria(self.scenario['evento_testo'], {"tipo": "breaking_news"})
             self.memorie[s['id']] = mem
 
-    def elabora_turno(self, id_sospettato, user_input, history_locale):
+    def elabora_turno(self, id_sospettato, user_input, conta_turno=True):
         """
         Gestisce il ciclo principale di interazione (Game Loop).
         Esegue la pipeline RAG -> Prompt -> Generation -> Validation.
+
+        Il prompt è ordinato per favorire il riuso della KV cache di Ollama:
+        System Prompt stabile -> Chat History -> contenuto variabile (RAG + domanda) in coda.
+        La Chat History è gestita internamente per ogni sospettato (self.storie_chat).
+        :param conta_turno: False se il turno è già stato contato dal chiamante (es. confronto di gruppo).
         """
-        self.turni_giocati += 1
+        with self._lock_stato:
+            if conta_turno:
+                self.turni_giocati += 1
+            turno = self.turni_giocati
         sospettato = next(s for s in self.scenario['sospettati'] if s['id'] == id_sospettato)
         memoria = self.memorie[id_sospettato]
 
         # A. Retrieval (RAG): Recupera i chunk di memoria più rilevanti per la domanda attuale
-        ricordi = memoria.recupera_contesto(user_input, n_results=Config.MAX_RICORDI_RAG)
+        # Degradazione controllata: se il recupero fallisce si risponde senza memoria a lungo termine
+        try:
+            ricordi = memoria.recupera_contesto(user_input, n_results=Config.MAX_RICORDI_RAG)
+        except Exception as e:
+            print(f"Errore recupero memoria: {e}")
+            ricordi = []
         context_rag = "\n".join([f"- {r}" for r in ricordi])
 
-        # B. Prompt Engineering: Costruzione dinamica del contesto per l'LLM
-        sys = self._costruisci_system_prompt(sospettato)
-        full_prompt = f"""
-                {sys}
-
-                [MEMORIA A LUNGO TERMINE (Cosa hai già detto)]: 
-                {context_rag}
+        # B. Prompt Engineering: prefisso stabile (Persona + Storia) e coda variabile
+        storia = self.storie_chat.setdefault(id_sospettato, [])
+        turno_corrente = f"""
+[MEMORIA A LUNGO TERMINE (Cosa hai già detto)]: 
+{context_rag}
 
-                [SITUAZIONE ATTUALE]:
-                Il Detective ti sta interrogando. La tensione è alta.
-                Domanda del Detective: "{user_input}"
+[SITUAZIONE ATTUALE]:
+Il Detective ti sta interrogando. La tensione è alta.
+Domanda del Detective: "{user_input}"
 
-                [TUA RISPOSTA]:
-                (Ricorda il tuo stile: {sospettato['personalita']}. Usa il tic comportamentale (*) solo se stai mentendo o sei in panico).
-                """
+[TUA RISPOSTA]:
+(Ricorda il tuo stile: {sospettato['personalita']}. Usa il tic comportamentale (*) solo se stai mentendo o sei in panico).
+"""
 
-        messages = [{'role': 'user', 'content': full_prompt}]
+        messages = [{'role': 'system', 'content': self._system_prompt_per(sospettato)}]
+        messages += storia
+        messages.append({'role': 'user', 'content': turno_corrente})
 
         # C. Generazione Neuro-Simbolica: Generazione con controllo fattuale
-        risposta = self._genera_verificata(sospettato, user_input, messages)
-
-        # D. Aggiornamento Memoria: Salva lo scambio corrente nel database vettoriale
+        statistiche = self._misura_prefill(id_sospettato, messages, turno)
+        try:
+            risposta = self._genera_verificata(sospettato, user_input, messages, statistiche)
+        except Exception as e:
+            # Server non disponibile o modello fuori personaggio: battuta di ripiego, senza sporcare
+            # Chat History e Memoria. Il turno non è stato giocato: non conta per il colpo di scena.
+            print(f"Errore generazione risposta: {e}")
+            with self._lock_stato:
+                self.metriche['risposte_ripiego'] += 1
+                if conta_turno:
+                    self.turni_giocati -= 1
+            return Config.RISPOSTA_DI_RIPIEGO
+        self._registra_prefill(id_sospettato, statistiche)
+
+        # D. Aggiornamento Memoria a Breve Termine: nella storia va solo la domanda (senza RAG),
+        # così i messaggi passati restano identici nei turni successivi
+        storia.append({'role': 'user', 'content': f'Domanda del Detective: "{user_input}"'})
+        storia.append({'role': 'assistant', 'content': risposta})
+        self._applica_politica_contesto(id_sospettato)
+
+        # E. Aggiornamento Memoria a Lungo Termine: Salva lo scambio corrente nel database vettoriale
         memoria.aggiungi_memoria(f"D: {user_input} R: {risposta}", {"role": "chat"})
 
         return risposta
 
+    def elabora_confronto(self, id_sospettati, user_input):
+        """
+        Confronto di gruppo: la stessa domanda viene posta a più sospettati contemporaneamente.
+        Le pipeline di elabora_turno (RAG, generazione, verifica) girano in parallelo su thread separati
+        e le risposte vengono restituite (generatore) man mano che sono pronte, come coppie (id, risposta).
+        Il tempo complessivo è vicino a quello del sospettato più lento, se il server Ollama
+        è configurato per servire richieste in parallelo (OLLAMA_NUM_PARALLEL).
+
+        Una domanda del Detective è un solo turno di gioco, qualunque sia il numero di sospettati
+        (non conta se nessun sospettato riesce a rispondere).
+        Come per l'interrogatorio singolo, la trascrizione per genera_rapporto_polizia() è tenuta dal chiamante.
+        """
+        # Un sospettato compare una sola volta: due thread sulla stessa Chat History la corromperebbero
+        id_sospettati = list(dict.fromkeys(id_sospettati))
+        if not id_sospettati:
+            return
+
+        with self._lock_stato:
+            self.turni_giocati += 1
+
+        with ThreadPoolExecutor(max_workers=len(id_sospettati)) as pool:
+            futuri = {pool.submit(self.elabora_turno, id_s, user_input, False): id_s for id_s in id_sospettati}
+            risposte_valide = 0
+            try:
+                for futuro in as_completed(futuri):
+                    id_s = futuri[futuro]
+                    try:
+                        risposta = futuro.result()
+                    except Exception as e:
+                        print(f"Errore interrogatorio sospettato {id_s}: {e}")
+                        continue
+                    if risposta != Config.RISPOSTA_DI_RIPIEGO:
+                        risposte_valide += 1
+                    yield id_s, risposta
+            finally:
+                if not risposte_valide:
+                    with self._lock_stato:
+                        self.turni_giocati -= 1
+
+    def _conta(self, metrica):
+        """Incrementa una metrica di gioco (thread-safe)."""
+        with self._lock_stato:
+            self.metriche[metrica] += 1
+
+    def _system_prompt_per(self, sospettato):
+        """Restituisce il System Prompt del sospettato, costruendolo una sola volta per partita."""
+        if sospettato['id'] not in self._system_prompts:
+            self._system_prompts[sospettato['id']] = self._costruisci_system_prompt(sospettato)
+        return self._system_prompts[sospettato['id']]
+
+    def _applica_politica_contesto(self, id_sospettato):
+        """
+        Politica di riuso del contesto (per sospettato).
+        Quando la Chat History supera la finestra massima, scarta gli scambi più vecchi in blocco:
+        tagliare un solo scambio per turno cambierebbe il prefisso (e invaliderebbe la cache) ogni volta.
+        """
+        storia = self.storie_chat.get(id_sospettato, [])
+        if len(storia) > Config.MAX_SCAMBI_STORIA * 2:
+            del storia[:Config.SCAMBI_DA_SCARTARE * 2]
+
+    def _misura_prefill(self, id_sospettato, messages, turno):
+        """
+        Stima i token del prompt e quelli del prefisso identico alla chiamata precedente
+        dello stesso sospettato. Quest'ultimo è solo un limite superiore teorico: tra due chiamate
+        dello stesso sospettato Ollama serve il Giudice, gli altri sospettati e il colpo di scena,
+        quindi su un server a slot singolo il prefisso può non essere più in cache.
+        Il risparmio effettivo è stimato in _registra_prefill() a partire dal prompt_eval_count di Ollama.
+        """
+        precedenti = self._ultimi_messaggi.get(id_sospettato, [])
+        comuni = 0
+        for vecchio, nuovo in zip(precedenti, messages):
+            if vecchio != nuovo:
+                break
+            comuni += 1
+        self._ultimi_messaggi[id_sospettato] = list(messages)
+
+        def stima(msgs):
+            return sum(len(m['content']) for m in msgs) // Config.CARATTERI_PER_TOKEN
+
+        return {
+            'turno': turno,
+            'token_prompt_stimati': stima(messages),
+            'token_riusabili_max': stima(messages[:comuni]),
+            'prompt_eval_count': None,  # Token effettivamente valutati da Ollama (se riportati)
+            'token_risparmiati_stimati': None,  # Token del prompt non rivalutati da Ollama (stima)
+        }
+
+    def _registra_prefill(self, id_sospettato, statistiche):
+        """
+        Stima il riuso effettivo della cache e archivia le statistiche di prefill del turno.
+        La prima chiamata di un sospettato (senza prefisso riusabile) è valutata per intero da Ollama:
+        il rapporto tra il suo prompt_eval_count e la stima a caratteri tara le stime dei turni successivi.
+        Il risparmio è la differenza tra il prompt (stima tarata) e i token valutati da Ollama,
+        mai oltre il prefisso riusabile.
+        """
+        valutati = statistiche['prompt_eval_count']
+        stimati = statistiche['token_prompt_stimati']
+        if valutati is not None and stimati:
+            if not statistiche['token_riusabili_max']:
+                # Chiamata a freddo: nessun risparmio possibile, serve solo a tarare la stima
+                self._taratura_prefill.setdefault(id_sospettato, valutati / stimati)
+                statistiche['token_risparmiati_stimati'] = 0
+            elif id_sospettato in self._taratura_prefill:
+                rapporto = self._taratura_prefill[id_sospettato]
+                risparmio = max(0, round(stimati * rapporto) - valutati)
+                statistiche['token_risparmiati_stimati'] = min(
+                    risparmio, round(statistiche['token_riusabili_max'] * rapporto))
+        self.statistiche_prefill.setdefault(id_sospettato, []).append(statistiche)
+        if Config.LOG_PRESTAZIONI:
+            print(f"[PREFILL] Sospettato {id_sospettato} | Turno {statistiche['turno']}: "
+                  f"~{stimati} token, valutati da Ollama: {valutati}, "
+                  f"stima risparmiati dalla cache: {statistiche['token_risparmiati_stimati']} "
+                  f"(massimo teorico ~{statistiche['token_riusabili_max']})")
+
     def _costruisci_system_prompt(self, s):
         """
         Definisce la 'Persona' dell'agente.
@@ -244,7 +526,7 @@ class GameEngine:
             COME COMPORTARTI:
             1. Dì la VERITÀ assoluta sul tuo alibi ({s['alibi']}). Vuoi che la polizia ti scagioni dall'omicidio.
             2. PROTEGGI IL SEGRETO: Se il detective fa domande che si avvicinano al tuo segreto ({s['segreto']}), diventa evasivo, nervoso o arrabbiato. NON rivelarlo a meno che non ti senta alle strette.
-            3. Se il detective svela l'indizio iniziale ({s['indizio-iniziale']}) svela il tuo segreto: {s['segreto']}.
+            3. Se il detective svela l'indizio iniziale ({s['indizio_iniziale']}) svela il tuo segreto: {s['segreto']}.
             4. Sii collaborativo sull'omicidio, ma reticente sulla tua vita privata.
             """
 
@@ -262,7 +544,7 @@ class GameEngine:
 
         return full_instruction
 
-    def _genera_verificata(self, sospettato, input_utente, messages):
+    def _genera_verificata(self, sospettato, input_utente, messages, statistiche=None):
         """
         Algoritmo principale per la mitigazione delle allucinazioni (Fact-Checking Loop).
         Implementa un pattern 'Generator-Discriminator' (o Actor-Critic):
@@ -271,9 +553,10 @@ class GameEngine:
         3. Un secondo LLM (in ruolo di Giudice) verifica la coerenza.
         4. Se incoerente, viene forzata una rigenerazione con istruzioni correttive.
         """
-        # 1. Generazione Iniziale (Tentativo dell'LLM)
-        res = ollama.chat(model=Config.MODEL_NAME, messages=messages)
-        testo_iniziale = res['message']['content']
+        # 1. Generazione Iniziale (Tentativo dell'LLM), protetta dalla guardia in streaming
+        testo_iniziale, finale = self._genera_protetta(messages)
+        if statistiche is not None and finale:
+            statistiche['prompt_eval_count'] = finale.get('prompt_eval_count')
 
         # 2. Retrieval Simbolico: Estrazione fatti dal Grafo
         fatti = self.kg.ottieni_fatti_su(sospettato['nome'])
@@ -287,10 +570,19 @@ class GameEngine:
 
         La battuta contraddice i fatti della trama? Rispondi SI/NO.
         """
-        check = ollama.chat(model=Config.MODEL_NAME, messages=[{'role': 'user', 'content': check_prompt}])
+        self._conta('verifiche')
+        try:
+            check = trasporto.chat(categoria="giudice", model=Config.MODEL_NAME,
+                                   messages=[{'role': 'user', 'content': check_prompt}], keep_alive=Config.KEEP_ALIVE)
+        except Exception as e:
+            # Degradazione controllata: senza Giudice si mantiene la risposta iniziale
+            print(f"Verifica saltata: {e}")
+            self._conta('verifiche_saltate')
+            return testo_iniziale
 
         # 4. Logica di Correzione (Feedback Loop)
         if "SI" in check['message']['content'].upper():
+            self._conta('correzioni')
 
             history_correzione = messages.copy()
 
@@ -309,19 +601,118 @@ class GameEngine:
 
             history_correzione.append({'role': 'user', 'content': istruzione_regista})
 
-            # Rigenerazione della risposta
-            res_corretta = ollama.chat(model=Config.MODEL_NAME, messages=history_correzione)
-            testo_corretto = res_corretta['message']['content']
-
-            # Guardrail di sicurezza: se la correzione contiene scuse da AI, fallback alla risposta originale
-            indicatori_ai = ["mi dispiace", "i'm sorry", "non posso", "language model", "modello linguistico"]
-            if any(x in testo_corretto.lower() for x in indicatori_ai):
+            # Rigenerazione della risposta (in caso di errore del server si mantiene la risposta iniziale)
+            try:
+                testo_corretto, motivo, _ = self._genera_in_streaming(history_correzione,
+                                                                     Config.INDICATORI_FUORI_PERSONAGGIO)
+            except Exception as e:
+                print(f"Correzione saltata: {e}")
+                self._conta('correzioni_saltate')
+                return testo_iniziale
+
+            # Guardrail di sicurezza: se la correzione contiene scuse da AI, fallback alla risposta originale.
+            # La generazione viene interrotta non appena compare l'indicatore.
+            if motivo == 'fuori_personaggio':
+                self._conta('fallback_ai')
                 return testo_iniziale  # Fallback alla prima risposta
+            if motivo == 'troppo_lunga':
+                return self._tronca_risposta(testo_corretto)
 
             return testo_corretto
 
         return testo_iniziale
 
+    def _genera_in_streaming(self, messages, indicatori=None):
+        """
+        Guardia in streaming: osserva i token man mano che arrivano e interrompe la generazione
+        (chiudendo la connessione con Ollama) appena compare un indicatore di uscita dal personaggio
+        o la risposta supera la lunghezza massima.
+        :param indicatori: Frasi che interrompono la generazione (default: Config.INDICATORI_ASSISTENTE_AI).
+        Restituisce (testo, motivo_interruzione, frammento_finale); il motivo è None se la generazione è completa.
+        """
+        indicatori = indicatori or Config.INDICATORI_ASSISTENTE_AI
+        flusso = trasporto.chat(model=Config.MODEL_NAME, messages=messages, stream=True,
+                                keep_alive=Config.KEEP_ALIVE)
+        # Basta controllare la coda del testo: gli indicatori precedenti sarebbero già stati intercettati
+        finestra = max(len(x) for x in indicatori) + 1
+        testo, motivo, finale = "", None, None
+        try:
+            for frammento in flusso:
+                pezzo = frammento['message']['content']
+                testo += pezzo
+                if frammento.get('done'):
+                    finale = frammento
+
+                trovato = self._cerca_indicatore(testo, indicatori, len(testo) - len(pezzo) - finestra)
+                # Un indicatore a fine testo può essere l'inizio di una parola più lunga ("as an ai" -> "as an aide"):
+                # si decide al frammento successivo (o al controllo finale)
+                if trovato and trovato.end() < len(testo):
+                    motivo = 'fuori_personaggio'
+                    break
+                if len(testo) > Config.MAX_CARATTERI_RISPOSTA:
+                    motivo = 'troppo_lunga'
+                    break
+        finally:
+            flusso.close()
+
+        if motivo is None and self._cerca_indicatore(testo, indicatori):
+            motivo = 'fuori_personaggio'
+        if motivo:
+            self._conta('interruzioni')
+        return testo, motivo, finale
+
+    @staticmethod
+    def _cerca_indicatore(testo, indicatori, inizio=0):
+        """Cerca un indicatore come parola intera (senza distinzione di maiuscole) a partire da 'inizio'."""
+        schema = r"\b(?:" + "|".join(re.escape(x) for x in indicatori) + r")\b"
+        return re.compile(schema, re.IGNORECASE).search(testo, max(0, inizio))
+
+    def _genera_protetta(self, messages):
+        """
+        Genera una battuta con la guardia in streaming. Se la generazione viene interrotta,
+        la richiesta viene ripetuta una sola volta con un'istruzione correttiva adatta al motivo.
+        Restituisce (testo, frammento_finale).
+        Se anche il secondo tentativo esce dal personaggio solleva RispostaFuoriPersonaggio: un frammento di battuta
+        non deve finire nella Chat History né nella memoria RAG.
+        """
+        testo, motivo, finale = self._genera_in_streaming(messages)
+        if motivo is None:
+            return testo, finale
+
+        if motivo == 'fuori_personaggio':
+            istruzione = """
+            [REGIA]
+            Stop. Sei uscito dal personaggio. Questo è un racconto di finzione:
+            NON scusarti, NON comportarti da assistente AI e rispondi SOLO con la battuta del personaggio.
+            """
+        else:
+            istruzione = """
+            [REGIA]
+            Stop. La battuta è troppo lunga. Rispondi in massimo 3 frasi, restando nel personaggio.
+            """
+        messages_corretti = messages + [{'role': 'user', 'content': istruzione}]
+        testo, motivo, finale = self._genera_in_streaming(messages_corretti)
+        if motivo is None:
+            return testo, finale
+
+        # Anche il secondo tentativo è stato interrotto
+        if motivo == 'fuori_personaggio':
+            raise RispostaFuoriPersonaggio("Il modello è uscito dal personaggio in entrambi i tentativi")
+        # Battuta troppo lunga: si mantiene fino all'ultima frase completa
+        return self._tronca_risposta(testo), finale
+
+    @staticmethod
+    def _tronca_risposta(testo):
+        """Taglia il testo all'ultima frase completa (o restituisce la battuta di ripiego se non resta nulla)."""
+        fine = max(testo.rfind(p) for p in ".!?*")
+        testo = (testo[:fine + 1] if fine > 0 else testo[:Config.MAX_CARATTERI_RISPOSTA]).strip()
+        return testo or Config.RISPOSTA_DI_RIPIEGO
+
+    def chiudi(self):
+        """Archivia i ricordi ancora in coda e ferma i worker di scrittura delle memorie RAG."""
+        for memoria in self.memorie.values():
+            memoria.chiudi()
+
         # --- GESTIONE PERSISTENZA DATI (I/O) ---
 
     def elenca_salvataggi(self):
@@ -347,6 +738,10 @@ class GameEngine:
         if not self.scenario:
             return "Errore: Nessuna partita attiva da salvare."
 
+        # I ricordi ancora in coda vengono archiviati prima di scrivere lo stato
+        for memoria in self.memorie.values():
+            memoria.svuota_coda()
+
         self.scenario['turni_giocati'] = self.turni_giocati
         self.scenario['evento_avvenuto'] = self.evento_avvenuto
 
@@ -424,7 +819,8 @@ class GameEngine:
             """
 
         try:
-            res = ollama.chat(model=Config.MODEL_NAME, messages=[{'role': 'user', 'content': prompt_analista}])
+            res = trasporto.chat(model=Config.MODEL_NAME, messages=[{'role': 'user', 'content': prompt_analista}],
+                                 keep_alive=Config.KEEP_ALIVE)
             return res['message']['content']
         except Exception as e:
             return f"Errore generazione rapporto: {e}"
@@ -434,15 +830,47 @@ class GameEngine:
         Gestisce la Narrazione Dinamica (Dynamic Storytelling).
         Controlla il progresso del gioco (turni) e inietta proceduralmente nuovi fatti (nodi)
         nel Grafo e nella Memoria RAG, simulando l'evoluzione delle indagini in tempo reale.
+
+        Il colpo di scena viene generato speculativamente in background quando mancano
+        Config.ANTICIPO_COLPO_SCENA turni alla soglia, e viene solo 'applicato' alla soglia.
+        Se alla soglia la preparazione non è ancora terminata, il colpo di scena slitta
+        al turno successivo invece di bloccare l'interrogatorio.
         """
-        SOGLIA_TURNI = 4  # Soglia di attivazione evento
+        # Verifica se l'evento è già accaduto
+        if self.evento_avvenuto:
+            return None
 
-        # Verifica se l'evento è già accaduto o se è troppo presto
-        if self.evento_avvenuto or self.turni_giocati < SOGLIA_TURNI:
+        # Avvio anticipato della generazione (una sola volta per partita)
+        if self.turni_giocati >= Config.SOGLIA_TURNI_COLPO_SCENA - Config.ANTICIPO_COLPO_SCENA:
+            self._avvia_prefetch_colpo_scena()
+
+        # Troppo presto, oppure la preparazione è ancora in corso
+        prefetch = self._prefetch_colpo_scena
+        if self.turni_giocati < Config.SOGLIA_TURNI_COLPO_SCENA or prefetch['thread'].is_alive():
             return None
 
-        print(">>> ENGINE: Generazione Colpo di Scena in corso...")
+        if prefetch['testo'] is None:
+            # Generazione fallita: si riprova in background al prossimo turno
+            self._prefetch_colpo_scena = None
+            return None
 
+        return self._applica_colpo_scena(prefetch)
+
+    def _avvia_prefetch_colpo_scena(self):
+        """Avvia (se non già avviata) la preparazione del colpo di scena su un thread in background."""
+        with self._lock_colpo_scena:
+            if self._prefetch_colpo_scena is not None:
+                return
+            prefetch = {'testo': None, 'embedding': None}
+            prefetch['thread'] = threading.Thread(target=self._prepara_colpo_scena, args=(prefetch,), daemon=True)
+            self._prefetch_colpo_scena = prefetch
+            prefetch['thread'].start()
+
+    def _prepara_colpo_scena(self, prefetch):
+        """
+        Fase di 'Staging': genera il testo del colpo di scena e il suo embedding
+        senza modificare lo stato del gioco (Grafo e RAG restano invariati).
+        """
         # 1. Generazione Creativa del Colpo di Scena
         prompt = f"""
         Sei uno scrittore di gialli.
@@ -462,28 +890,43 @@ class GameEngine:
         """
 
         try:
-            res = ollama.chat(model=Config.MODEL_NAME, messages=[{'role': 'user', 'content': prompt}])
+            res = trasporto.chat(model=Config.MODEL_NAME, messages=[{'role': 'user', 'content': prompt}],
+                                 keep_alive=Config.KEEP_ALIVE)
             nuovo_fatto = res['message']['content'].strip()
 
-            # 2. Aggiornamento dello Stato del Gioco
+            # 2. Embedding calcolato una sola volta: il testo è identico per tutti i sospettati
+            memoria = next(iter(self.memorie.values()), None)
+            if memoria is not None:
+                prefetch['embedding'] = memoria.calcola_embedding(nuovo_fatto)
+            prefetch['testo'] = nuovo_fatto
+
+        except Exception as e:
+            print(f"Errore generazione evento: {e}")
+
+    def _applica_colpo_scena(self, prefetch):
+        """
+        Fase di 'Commit': applica il colpo di scena preparato a Stato, Grafo e RAG in un unico passo.
+        """
+        with self._lock_colpo_scena:
+            if self.evento_avvenuto or self._prefetch_colpo_scena is not prefetch:
+                return None
+            nuovo_fatto = prefetch['testo']
+
+            # 1. Aggiornamento dello Stato del Gioco
             self.evento_avvenuto = True
             self.scenario['evento_testo'] = nuovo_fatto  # Persistenza nel JSON
 
-            # 3. Aggiornamento Simbolico (Knowledge Graph)
+            # 2. Aggiornamento Simbolico (Knowledge Graph)
             # Inserisce il nuovo fatto come nodo, rendendolo "verità" per il Fact-Checker
             self.kg.aggiungi_fatto(nuovo_fatto)
 
-            # 4. Aggiornamento Semantico (RAG)
+            # 3. Aggiornamento Semantico (RAG)
             # Propaga l'informazione a tutti gli agenti, simulando la diffusione della notizia
             for id_sosp, memoria in self.memorie.items():
-                memoria.aggiungi_memoria(nuovo_fatto, {"tipo": "breaking_news"})
+                memoria.aggiungi_memoria(nuovo_fatto, {"tipo": "breaking_news"}, embedding=prefetch['embedding'])
 
             return nuovo_fatto
 
-        except Exception as e:
-            print(f"Errore generazione evento: {e}")
-            return None
-
     def apri_questionario(self):
         """
         Mostra il messaggio finale e tenta di aprire il browser automaticamente.
@@ -1,56 +1,216 @@
+import math
+import queue
+import threading
+
 import chromadb
-import ollama
 import uuid
+from config import Config
+from TrasportoOllama import trasporto
 
 class MemoriaRAG:
     """
     Gestisce la memoria a lungo termine dei personaggi usando RAG (Retrieval-Augmented Generation).
     Utilizza ChromaDB come database vettoriale per archiviare e recuperare frammenti di conversazione
     o fatti basati sulla similarità semantica.
+
+    Le scritture sono 'Write-Behind': aggiungi_memoria() accoda il ricordo e ritorna subito,
+    mentre un worker in background calcola gli embedding (a lotti) e li salva su ChromaDB.
+    Le letture attendono lo svuotamento della coda, quindi vedono sempre tutti i ricordi aggiunti.
     """
+    _FINE = object()  # Sentinella che ferma il worker
+
     def __init__(self, collection_name="investigazione"):
         # ChromaDB client effimero (resetta alla chiusura script)
         self.client = chromadb.Client()
+        # La collezione parte sempre vuota: il client effimero è condiviso nel processo e, senza reset,
+        # una nuova partita erediterebbe i ricordi della precedente (es. nella simulazione headless).
+        # I ricordi validi vengono ripopolati da GameEngine.inizializza_dati().
         try:
-            self.collection = self.client.get_or_create_collection(name=collection_name)
-        except:
             self.client.delete_collection(collection_name)
-            self.collection = self.client.create_collection(name=collection_name)
+        except Exception:
+            pass
+        self.collection = self.client.create_collection(name=collection_name)
 
-    def _get_embedding(self, text):
+        # Coda di scrittura e worker (avviato alla prima scrittura)
+        self._coda = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+        # Statistiche di ogni recupero (per calibrare soglia di distanza e budget)
+        self.statistiche = []
+
+    def calcola_embedding(self, text):
         """
         Genera l'embedding vettoriale per un testo usando il modello locale via Ollama.
         Richiede che il modello 'nomic-embed-text' sia installato (ollama pull nomic-embed-text).
+        Il vettore può essere passato ad aggiungi_memoria() per archiviare il testo senza ricalcolarlo.
         """
+        return self._get_embeddings([text])[0]
+
+    def _get_embeddings(self, testi):
+        """Genera gli embedding di più testi con una sola chiamata (batch) al modello."""
         # Richiede: ollama pull nomic-embed-text
-        response = ollama.embeddings(model='nomic-embed-text', prompt=text)
-        return response['embedding']
+        response = trasporto.embed(model=Config.EMBEDDING_MODEL, input=testi, keep_alive=Config.KEEP_ALIVE)
+        return response['embeddings']
 
-    def aggiungi_memoria(self, testo, metadati):
+    def aggiungi_memoria(self, testo, metadati, embedding=None):
         """
-        Archivia un nuovo ricordo nel database vettoriale.
+        Accoda un nuovo ricordo per l'archiviazione nel database vettoriale (non bloccante).
         :param testo: Il contenuto testuale del ricordo (es. una frase detta).
         :param metadati: Dizionario con info extra (es. chi l'ha detto, timestamp, tipo).
+        :param embedding: Vettore già calcolato (opzionale), evita una nuova chiamata al modello.
         """
-        vettore = self._get_embedding(testo)
-        self.collection.add(
-            documents=[testo],
-            embeddings=[vettore],
-            metadatas=[metadati],
-            ids=[str(uuid.uuid4())]
-        )
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._elabora_coda, daemon=True)
+                self._worker.start()
+        self._coda.put((testo, metadati, embedding))
+
+    def _elabora_coda(self):
+        """Worker in background: raccoglie i ricordi in attesa e li archivia a lotti."""
+        while True:
+            elemento = self._coda.get()
+            if elemento is self._FINE:
+                self._coda.task_done()
+                return
+
+            # Raccoglie gli altri ricordi già in coda (fino alla dimensione massima del lotto)
+            lotto = [elemento]
+            fine = False
+            while len(lotto) < Config.RAG_BATCH_MAX:
+                try:
+                    successivo = self._coda.get_nowait()
+                except queue.Empty:
+                    break
+                if successivo is self._FINE:
+                    fine = True
+                    break
+                lotto.append(successivo)
+
+            try:
+                self._archivia(lotto)
+            except Exception as e:
+                print(f"Errore archiviazione memoria: {e}")
+            finally:
+                for _ in lotto:
+                    self._coda.task_done()
+
+            if fine:
+                self._coda.task_done()
+                return
+
+    def _archivia(self, lotto):
+        """Calcola gli embedding mancanti con una sola chiamata e salva l'intero lotto su ChromaDB."""
+        da_calcolare = [testo for testo, _, embedding in lotto if embedding is None]
+        calcolati = self._get_embeddings(da_calcolare) if da_calcolare else []
+        if len(calcolati) != len(da_calcolare):
+            raise ValueError(f"Ricevuti {len(calcolati)} embedding per {len(da_calcolare)} ricordi")
+        calcolati = iter(calcolati)
+        vettori = [embedding if embedding is not None else next(calcolati) for _, _, embedding in lotto]
+
+        with self._lock:
+            self.collection.add(
+                documents=[testo for testo, _, _ in lotto],
+                embeddings=vettori,
+                metadatas=[metadati for _, metadati, _ in lotto],
+                ids=[str(uuid.uuid4()) for _ in lotto]
+            )
+
+    def svuota_coda(self):
+        """Attende che tutti i ricordi in coda siano stati archiviati (Flush)."""
+        self._coda.join()
+
+    def chiudi(self):
+        """Archivia i ricordi in sospeso e ferma il worker in background."""
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._coda.put(self._FINE)
+            worker.join()
 
     def recupera_contesto(self, query, n_results=3):
         """
-        Cerca i ricordi più rilevanti semanticamente rispetto alla query.
+        Cerca i ricordi più rilevanti semanticamente rispetto alla query (Recupero Adattivo).
+        - Collezioni piccole (es. i soli fatti forensi) vengono incluse per intero, senza embedding della query.
+        - Altrimenti i candidati più lontani di Config.RAG_DISTANZA_MAX vengono scartati e la selezione
+          avviene con MMR, evitando ricordi quasi duplicati.
+        - Il contesto finale rispetta il budget di token Config.RAG_BUDGET_TOKEN.
         :param query: La frase attuale o domanda per cui cercare contesto.
-        :param n_results: Numero di frammenti da recuperare.
+        :param n_results: Numero massimo di frammenti da recuperare.
         """
-        vettore = self._get_embedding(query)
-        results = self.collection.query(
-            query_embeddings=[vettore],
-            n_results=n_results
-        )
-        if results['documents']:
-            return results['documents'][0]
-        return []
\ No newline at end of file
+        # Consistenza in lettura: i ricordi ancora in coda devono essere visibili
+        self.svuota_coda()
+
+        with self._lock:
+            totale = self.collection.count()
+        stat = {'totale': totale, 'scorciatoia': False, 'candidati': 0, 'distanze': [],
+                'scartati_distanza': 0, 'scartati_duplicati': 0, 'scartati_budget': 0}
+
+        if totale == 0:
+            documenti = []
+        elif totale <= Config.RAG_SOGLIA_COLLEZIONE_PICCOLA:
+            stat['scorciatoia'] = True
+            with self._lock:
+                documenti = self.collection.get(include=['documents'])['documents']
+            stat['candidati'] = len(documenti)
+        else:
+            vettore = self.calcola_embedding(query)
+            with self._lock:
+                results = self.collection.query(
+                    query_embeddings=[vettore],
+                    n_results=min(totale, max(n_results, Config.RAG_CANDIDATI)),
+                    include=['documents', 'distances', 'embeddings']
+                )
+            candidati = list(zip(results['documents'][0], results['distances'][0], results['embeddings'][0]))
+            stat['candidati'] = len(candidati)
+            stat['distanze'] = [round(float(d), 3) for _, d, _ in candidati]
+
+            vicini = [c for c in candidati if c[1] <= Config.RAG_DISTANZA_MAX]
+            stat['scartati_distanza'] = len(candidati) - len(vicini)
+            documenti = self._seleziona_mmr(vettore, vicini, n_results, stat)
+
+        documenti = self._applica_budget(documenti, stat)
+        stat['selezionati'] = len(documenti)
+        self.statistiche.append(stat)
+        if Config.LOG_PRESTAZIONI:
+            print(f"[RAG] {self.collection.name}: {stat}")
+        return documenti
+
+    @staticmethod
+    def _coseno(a, b):
+        prodotto = sum(x * y for x, y in zip(a, b))
+        norme = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+        return prodotto / norme if norme else 0.0
+
+    def _seleziona_mmr(self, vettore, candidati, n_results, stat):
+        """Selezione MMR: alterna rilevanza rispetto alla query e diversità rispetto ai ricordi già scelti."""
+        rilevanza = {i: self._coseno(vettore, emb) for i, (_, _, emb) in enumerate(candidati)}
+        scelti = []
+        rimanenti = list(range(len(candidati)))
+        while rimanenti and len(scelti) < n_results:
+            migliore, punteggio_migliore, somiglianza_migliore = None, None, 0.0
+            for i in rimanenti:
+                somiglianza = max((self._coseno(candidati[i][2], candidati[j][2]) for j in scelti), default=0.0)
+                punteggio = Config.RAG_MMR_LAMBDA * rilevanza[i] - (1 - Config.RAG_MMR_LAMBDA) * somiglianza
+                if punteggio_migliore is None or punteggio > punteggio_migliore:
+                    migliore, punteggio_migliore, somiglianza_migliore = i, punteggio, somiglianza
+            rimanenti.remove(migliore)
+            if somiglianza_migliore >= Config.RAG_SOGLIA_DUPLICATO:
+                stat['scartati_duplicati'] += 1
+                continue
+            scelti.append(migliore)
+        return [candidati[i][0] for i in scelti]
+
+    @staticmethod
+    def _applica_budget(documenti, stat):
+        """Mantiene i documenti (in ordine di priorità) finché rientrano nel budget di token."""
+        selezionati, token = [], 0
+        for doc in documenti:
+            costo = len(doc) // Config.CARATTERI_PER_TOKEN
+            if token + costo > Config.RAG_BUDGET_TOKEN:
+                stat['scartati_budget'] += 1
+                continue
+            selezionati.append(doc)
+            token += costo
+        stat['token'] = token
+        return selezionati
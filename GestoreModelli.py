@@ -0,0 +1,90 @@
+import threading
+import time
+
+from config import Config
+from TrasportoOllama import trasporto
+
+
+class GestoreModelli:
+    """
+    Gestisce il 'Warm-Up' dei modelli locali di Ollama.
+    Al primo utilizzo Ollama deve caricare i pesi in memoria (Cold Start), operazione che richiede
+    diversi secondi. Questa classe precarica in background il modello generativo e quello di embedding
+    con richieste minime, mantenendoli residenti per tutta la sessione tramite 'keep_alive'.
+    """
+
+    def __init__(self):
+        # Un evento per ogni modello: viene impostato quando il caricamento è terminato (con o senza errori)
+        self._pronti = {
+            Config.MODEL_NAME: threading.Event(),
+            Config.EMBEDDING_MODEL: threading.Event(),
+        }
+        self.errori = {}  # Modello -> messaggio di errore del warm-up
+        self.tempi_caricamento = {}  # Modello -> secondi impiegati per il caricamento
+        self._avviato = False
+
+    def avvia(self):
+        """Avvia il precaricamento dei modelli su thread in background (non bloccante)."""
+        if self._avviato:
+            return
+        self._avviato = True
+
+        threading.Thread(target=self._precarica, args=(Config.MODEL_NAME, self._carica_chat), daemon=True).start()
+        threading.Thread(target=self._precarica, args=(Config.EMBEDDING_MODEL, self._carica_embedding),
+                         daemon=True).start()
+
+    def _precarica(self, modello, funzione_caricamento):
+        inizio = time.perf_counter()
+        try:
+            funzione_caricamento()
+        except Exception as e:
+            self.errori[modello] = str(e)
+        finally:
+            self.tempi_caricamento[modello] = time.perf_counter() - inizio
+            self._pronti[modello].set()
+
+    @staticmethod
+    def _carica_chat():
+        # Una chat senza messaggi carica il modello senza generare token
+        trasporto.chat(categoria="warmup", model=Config.MODEL_NAME, messages=[], keep_alive=Config.KEEP_ALIVE)
+
+    @staticmethod
+    def _carica_embedding():
+        trasporto.embed(categoria="warmup", model=Config.EMBEDDING_MODEL, input="warm-up",
+                        keep_alive=Config.KEEP_ALIVE)
+
+    def pronto(self):
+        """True se tutti i modelli hanno terminato il warm-up."""
+        return all(evento.is_set() for evento in self._pronti.values())
+
+    def attendi(self, timeout=None):
+        """
+        Blocca finché i modelli non sono pronti (o scade il timeout).
+        Restituisce True se il warm-up è terminato.
+        """
+        scadenza = None if timeout is None else time.monotonic() + timeout
+        for evento in self._pronti.values():
+            residuo = None if scadenza is None else max(0.0, scadenza - time.monotonic())
+            if not evento.wait(residuo):
+                return False
+        return True
+
+    def stato(self):
+        """Descrizione leggibile dello stato di caricamento dei modelli."""
+        righe = []
+        for modello, evento in self._pronti.items():
+            if not evento.is_set():
+                righe.append(f"{modello}: caricamento in corso...")
+            elif modello in self.errori:
+                righe.append(f"{modello}: ERRORE ({self.errori[modello]})")
+            else:
+                righe.append(f"{modello}: pronto ({self.tempi_caricamento[modello]:.1f}s)")
+        return " | ".join(righe)
+
+    def rilascia(self):
+        """Scarica i modelli dalla memoria di Ollama (keep_alive=0) a fine sessione."""
+        try:
+            trasporto.chat(categoria="warmup", model=Config.MODEL_NAME, messages=[], keep_alive=0)
+            trasporto.embed(categoria="warmup", model=Config.EMBEDDING_MODEL, input="", keep_alive=0)
+        except Exception as e:
+            print(f"Errore rilascio modelli: {e}")
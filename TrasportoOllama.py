@@ -0,0 +1,339 @@
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from collections import deque
+
+import httpx
+import ollama
+from config import Config
+
+
+class CassettaEsaurita(RuntimeError):
+    """Sollevata in riproduzione quando la cassetta non contiene una risposta per la richiesta."""
+
+
+class CircuitoAperto(RuntimeError):
+    """Sollevata senza contattare il server quando il Circuit Breaker è aperto (server in errore)."""
+
+
+class InterruttoreCircuito:
+    """
+    Circuit Breaker per una categoria di chiamate al server Ollama.
+    Dopo Config.SOGLIA_GUASTI_CIRCUITO errori consecutivi il circuito si apre e le chiamate falliscono
+    subito (Fail-Fast) per Config.PAUSA_CIRCUITO secondi; poi una sola chiamata di prova (semi-aperto)
+    decide se richiuderlo o riaprirlo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.guasti_consecutivi = 0
+        self.aperto_fino_a = None  # Istante (monotonic) di fine pausa; None se il circuito è chiuso
+        self._prova_in_corso = False
+
+    def verifica(self):
+        """Solleva CircuitoAperto se la chiamata non deve raggiungere il server."""
+        with self._lock:
+            if self.aperto_fino_a is None:
+                return
+            if time.monotonic() < self.aperto_fino_a or self._prova_in_corso:
+                raise CircuitoAperto("Server Ollama non disponibile (circuito aperto)")
+            self._prova_in_corso = True  # Stato semi-aperto: passa una sola chiamata di prova
+
+    def successo(self):
+        with self._lock:
+            self.guasti_consecutivi = 0
+            self.aperto_fino_a = None
+            self._prova_in_corso = False
+
+    def guasto(self):
+        with self._lock:
+            self.guasti_consecutivi += 1
+            if self._prova_in_corso or self.guasti_consecutivi >= Config.SOGLIA_GUASTI_CIRCUITO:
+                self.aperto_fino_a = time.monotonic() + Config.PAUSA_CIRCUITO
+            self._prova_in_corso = False
+
+
+class TrasportoOllama:
+    """
+    Livello di trasporto unico per tutte le chiamate a Ollama (chat ed embedding).
+    Supporta tre modalità:
+    - 'live': inoltra le richieste al server Ollama.
+    - 'registra': inoltra le richieste e salva coppie richiesta/risposta (con i tempi) su una cassetta.
+    - 'riproduci': restituisce le risposte registrate senza contattare il server, in modo deterministico,
+      alla velocità originale oppure istantaneamente.
+
+    Le chiamate reali condividono un pool di connessioni HTTP keep-alive, con timeout per categoria
+    di chiamata ('generazione', 'giudice', 'embedding', 'warmup'), retry con jitter per le categorie
+    idempotenti e un Circuit Breaker che fa fallire subito le chiamate quando il server è in errore.
+
+    La cassetta è un file JSON Lines compresso (gzip): un record per chiamata, scritto come membro gzip
+    indipendente, così un'esecuzione interrotta lascia una cassetta leggibile fino all'ultimo record completo.
+    Le chiamate in streaming (stream=True) registrano i singoli frammenti con il loro istante di arrivo;
+    se lo stream viene interrotto dal chiamante si registra solo la parte effettivamente ricevuta.
+    """
+
+    MODALITA = ("live", "registra", "riproduci")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.modalita = "live"
+        self.percorso = None
+        self.istantaneo = False
+        self._file = None
+        self._per_chiave = {}  # Chiave richiesta -> coda di record (riproduzione per corrispondenza esatta)
+        self._per_tipo = {}  # Tipo chiamata -> coda di record (riproduzione in ordine, se la chiave manca)
+        self.mancati = 0  # Richieste riprodotte senza corrispondenza esatta
+
+        # Pool di connessioni condiviso e un client per categoria (ognuno con il proprio timeout)
+        self._pool = None
+        self._client = {}
+        # Un Circuit Breaker per categoria: un Giudice in timeout non blocca la generazione delle battute
+        self.circuiti = {categoria: InterruttoreCircuito() for categoria in Config.TIMEOUT_CHIAMATE}
+
+    def configura(self, modalita=None, percorso=None, istantaneo=None):
+        """Imposta la modalità di trasporto (di default legge i valori da Config)."""
+        self.chiudi()
+        modalita = modalita or Config.MODALITA_TRASPORTO
+        if modalita not in self.MODALITA:
+            raise ValueError(f"Modalità di trasporto sconosciuta: {modalita}")
+
+        with self._lock:
+            self.modalita = modalita
+            self.percorso = percorso or Config.CASSETTA_PATH
+            self.istantaneo = Config.RIPRODUZIONE_ISTANTANEA if istantaneo is None else istantaneo
+            self._per_chiave, self._per_tipo, self.mancati = {}, {}, 0
+
+            if modalita == "registra":
+                cartella = os.path.dirname(self.percorso)
+                if cartella and not os.path.exists(cartella):
+                    os.makedirs(cartella)
+                self._file = open(self.percorso, 'wb')
+            elif modalita == "riproduci":
+                self._carica_cassetta()
+
+    def _carica_cassetta(self):
+        for record in self._leggi_record():
+            self._per_chiave.setdefault(record['chiave'], deque()).append(record)
+            self._per_tipo.setdefault(record['tipo'], deque()).append(record)
+
+    def _leggi_record(self):
+        """Legge i record della cassetta, ignorando l'ultimo se troncato (registrazione interrotta)."""
+        with gzip.open(self.percorso, 'rt', encoding='utf-8') as f:
+            try:
+                for riga in f:
+                    if not riga.strip():
+                        continue
+                    try:
+                        yield json.loads(riga)
+                    except json.JSONDecodeError:
+                        print(f"Cassetta {self.percorso}: record troncato ignorato")
+                        return
+            except (EOFError, gzip.BadGzipFile, zlib.error):
+                print(f"Cassetta {self.percorso}: record troncato ignorato")
+
+    def chiudi(self):
+        """Chiude la cassetta in registrazione (ogni record è già scritto su disco)."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # --- API PUBBLICA (stessa firma delle funzioni del modulo ollama) ---
+
+    def chat(self, categoria="generazione", **kwargs):
+        return self._esegui("chat", categoria, kwargs)
+
+    def embed(self, categoria="embedding", **kwargs):
+        return self._esegui("embed", categoria, kwargs)
+
+    # --- LOGICA INTERNA ---
+
+    @staticmethod
+    def _chiave(tipo, richiesta):
+        # keep_alive non influisce sulla risposta: è escluso per poter riprodurre con configurazioni diverse
+        dati = {k: v for k, v in richiesta.items() if k != 'keep_alive'}
+        testo = json.dumps({'tipo': tipo, **dati}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(testo.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _serializza(risposta):
+        # Le versioni recenti della libreria restituiscono modelli Pydantic, le precedenti dizionari
+        if hasattr(risposta, 'model_dump'):
+            return risposta.model_dump(mode='json', exclude_none=True)
+        return dict(risposta)
+
+    def _client_per(self, categoria):
+        """Restituisce (creandolo alla prima chiamata) il client della categoria, sul pool condiviso."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = httpx.HTTPTransport(limits=httpx.Limits(
+                    max_connections=Config.MAX_CONNESSIONI_OLLAMA,
+                    max_keepalive_connections=Config.MAX_CONNESSIONI_OLLAMA,
+                    keepalive_expiry=Config.DURATA_KEEP_ALIVE_CONNESSIONI,
+                ))
+            if categoria not in self._client:
+                self._client[categoria] = ollama.Client(
+                    host=Config.OLLAMA_HOST,
+                    timeout=httpx.Timeout(Config.TIMEOUT_CHIAMATE[categoria], connect=Config.TIMEOUT_CONNESSIONE),
+                    transport=self._pool,
+                )
+            return self._client[categoria]
+
+    def _chiama(self, tipo, categoria, richiesta):
+        """
+        Chiamata reale al server, protetta dal Circuit Breaker.
+        Le categorie idempotenti vengono ripetute con backoff esponenziale e jitter.
+        """
+        funzione = getattr(self._client_per(categoria), tipo)
+        circuito = self.circuiti[categoria]
+        tentativi = Config.TENTATIVI_CHIAMATE if categoria in Config.CATEGORIE_IDEMPOTENTI else 1
+        for tentativo in range(tentativi):
+            circuito.verifica()
+            try:
+                risposta = funzione(**richiesta)
+            except ollama.ResponseError as e:
+                if 0 <= e.status_code < 500:
+                    # Errore della richiesta (es. modello mancante): il server risponde, ripetere non serve
+                    circuito.successo()
+                    raise
+                circuito.guasto()
+                if tentativo == tentativi - 1:
+                    raise
+            except Exception:
+                circuito.guasto()
+                if tentativo == tentativi - 1:
+                    raise
+            else:
+                if richiesta.get('stream'):
+                    return self._sorveglia_stream(risposta, circuito)
+                circuito.successo()
+                return risposta
+            # Full jitter: attesa casuale fino al backoff esponenziale del tentativo
+            time.sleep(random.uniform(0, Config.BACKOFF_BASE * 2 ** tentativo))
+
+    @staticmethod
+    def _sorveglia_stream(flusso, circuito):
+        """Gli errori possono arrivare anche durante lo streaming: vengono contati dal Circuit Breaker."""
+        try:
+            yield from flusso
+        except GeneratorExit:
+            # Stream interrotto dal chiamante (es. guardia in streaming): il server ha risposto
+            circuito.successo()
+            raise
+        except ollama.ResponseError as e:
+            # Come per le chiamate normali: un errore 4xx è una risposta del server, non un guasto
+            if 0 <= e.status_code < 500:
+                circuito.successo()
+            else:
+                circuito.guasto()
+            raise
+        except Exception:
+            circuito.guasto()
+            raise
+        else:
+            circuito.successo()
+        finally:
+            flusso.close()
+
+    def _esegui(self, tipo, categoria, richiesta):
+        if richiesta.get('stream'):
+            # Tipo distinto: in riproduzione un record a frammenti non deve rispondere a una chiamata normale
+            return self._esegui_stream(tipo, categoria, richiesta)
+
+        if self.modalita == "riproduci":
+            record = self._preleva(tipo, richiesta)
+            if not self.istantaneo:
+                time.sleep(record['durata'])
+            return record['risposta']
+
+        inizio = time.perf_counter()
+        risposta = self._chiama(tipo, categoria, richiesta)
+        durata = time.perf_counter() - inizio
+
+        if self.modalita == "registra":
+            self._registra(tipo, richiesta, self._serializza(risposta), durata)
+        return risposta
+
+    def _registra(self, tipo, richiesta, risposta, durata):
+        record = {
+            'tipo': tipo,
+            'chiave': self._chiave(tipo, richiesta),
+            'richiesta': richiesta,
+            'risposta': risposta,
+            'durata': round(durata, 4),
+        }
+        riga = json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str)
+        with self._lock:
+            if self._file is not None:
+                # Un membro gzip per record: se il processo termina senza chiudi() si perde al più l'ultimo
+                self._file.write(gzip.compress((riga + "\n").encode('utf-8')))
+                self._file.flush()
+
+    def _esegui_stream(self, tipo, categoria, richiesta):
+        if self.modalita == "riproduci":
+            return self._riproduci_stream(self._preleva(f"{tipo}_stream", richiesta))
+
+        inizio = time.perf_counter()
+        flusso = self._chiama(tipo, categoria, richiesta)
+        if self.modalita == "registra":
+            return self._registra_stream(f"{tipo}_stream", richiesta, flusso, inizio)
+        return flusso
+
+    def _registra_stream(self, tipo, richiesta, flusso, inizio):
+        frammenti = []
+        try:
+            for frammento in flusso:
+                frammenti.append([round(time.perf_counter() - inizio, 4), self._serializza(frammento)])
+                yield frammento
+        finally:
+            # Chiudere il flusso interrompe la generazione anche lato server
+            flusso.close()
+            self._registra(tipo, richiesta, frammenti, time.perf_counter() - inizio)
+
+    def _riproduci_stream(self, record):
+        precedente = 0.0
+        for istante, frammento in record['risposta']:
+            if not self.istantaneo:
+                time.sleep(max(0.0, istante - precedente))
+            precedente = istante
+            yield frammento
+
+    def _preleva(self, tipo, richiesta):
+        """Estrae dalla cassetta il record che risponde alla richiesta."""
+        chiave = self._chiave(tipo, richiesta)
+        with self._lock:
+            coda = self._per_chiave.get(chiave)
+            if coda:
+                record = coda.popleft()
+                self._per_tipo[tipo].remove(record)
+            else:
+                # Nessuna corrispondenza esatta (es. input diverso): si usa il prossimo record compatibile
+                # dello stesso tipo
+                record = next((r for r in self._per_tipo.get(tipo, ()) if self._compatibile(r, richiesta)), None)
+                if record is None:
+                    raise CassettaEsaurita(f"Nessuna risposta registrata per la chiamata '{tipo}'")
+                self._per_tipo[tipo].remove(record)
+                self._per_chiave[record['chiave']].remove(record)
+                self.mancati += 1
+        return record
+
+    @staticmethod
+    def _compatibile(record, richiesta):
+        """Un embedding registrato risponde solo a una richiesta con lo stesso numero di testi."""
+        if record['tipo'] != "embed":
+            return True
+
+        def numero_testi(dati):
+            testi = dati.get('input')
+            return 1 if isinstance(testi, str) else len(testi or ())
+
+        return numero_testi(record['richiesta']) == numero_testi(richiesta)
+
+
+# Istanza condivisa usata da GameEngine, MemoriaRAG e dagli altri moduli
+trasporto = TrasportoOllama()
@@ -13,6 +13,37 @@ class Config:
     # Modello di Embedding: Trasforma il testo in vettori per la ricerca semantica nel RAG (ChromaDB).
     EMBEDDING_MODEL = 'nomic-embed-text'
 
+    # --- CONNESSIONE AL SERVER OLLAMA ---
+    # Indirizzo del server (None = variabile d'ambiente OLLAMA_HOST o default locale).
+    OLLAMA_HOST = None
+    # Pool di connessioni HTTP keep-alive condiviso da tutte le chiamate.
+    MAX_CONNESSIONI_OLLAMA = 10
+    DURATA_KEEP_ALIVE_CONNESSIONI = 60
+    # Timeout (secondi) per categoria di chiamata; in streaming vale come attesa massima tra due frammenti.
+    TIMEOUT_CONNESSIONE = 5
+    TIMEOUT_CHIAMATE = {
+        'generazione': 180,  # Battute, scenario, intro, rapporti, colpo di scena
+        'giudice': 30,  # Verifica SI/NO del Fact-Checker
+        'embedding': 15,
+        'warmup': 300,  # Il primo caricamento del modello può essere lento
+    }
+    # Le categorie idempotenti vengono ripetute in caso di errore (backoff esponenziale con jitter).
+    CATEGORIE_IDEMPOTENTI = ('giudice', 'embedding', 'warmup')
+    TENTATIVI_CHIAMATE = 3
+    BACKOFF_BASE = 0.5
+    # Circuit Breaker: dopo N errori consecutivi le chiamate falliscono subito per PAUSA_CIRCUITO secondi.
+    SOGLIA_GUASTI_CIRCUITO = 5
+    PAUSA_CIRCUITO = 30
+
+    # --- TRASPORTO (REGISTRAZIONE / RIPRODUZIONE CHIAMATE) ---
+    # 'live': chiamate reali a Ollama | 'registra': chiamate reali salvate su cassetta |
+    # 'riproduci': risposte lette dalla cassetta, senza contattare Ollama.
+    MODALITA_TRASPORTO = "live"
+    # Cassetta (JSON Lines compresso) usata in registrazione (sovrascritta) e riproduzione.
+    CASSETTA_PATH = "cassette/sessione.jsonl.gz"
+    # In riproduzione: True restituisce subito le risposte, False rispetta i tempi originali.
+    RIPRODUZIONE_ISTANTANEA = False
+
     # --- IPERPARAMETRI DI GENERAZIONE (TEMPERATURE) ---
     # Temperatura alta (0.7): Aumenta la varianza e la creatività.
     # Usata per: Generazione dello scenario, dialoghi dei personaggi (Roleplay), descrizioni narrative.
@@ -22,14 +53,89 @@ class Config:
     # Usata per: Estrazione JSON, verifica logica (Fact-Checking), analisi forense.
     TEMPERATURE_LOGICA = 0.1
 
+    # --- RIUSO DEL CONTESTO (KV CACHE DI OLLAMA) ---
+    # Tempo per cui Ollama mantiene il modello (e la sua KV cache) in memoria dopo ogni chiamata.
+    # Usato anche dal warm-up iniziale per tenere i modelli residenti durante la sessione.
+    KEEP_ALIVE = "30m"
+    # Se True, a fine sessione i modelli vengono scaricati dalla memoria (keep_alive=0).
+    SCARICA_MODELLI_ALL_USCITA = False
+    # Attesa massima (secondi) del warm-up prima di avviare il gioco: oltre, i modelli finiscono
+    # di caricarsi durante la prima richiesta reale.
+    ATTESA_MAX_WARMUP = 30
+    # Finestra mobile della Chat History per ogni sospettato (numero di scambi Domanda/Risposta).
+    MAX_SCAMBI_STORIA = 8
+    # Quando la finestra è piena si scartano più scambi in blocco: il prefisso del prompt
+    # resta identico per diversi turni consecutivi e la cache viene invalidata raramente.
+    SCAMBI_DA_SCARTARE = 4
+    # Stima grossolana usata per misurare i token (circa 4 caratteri per token).
+    CARATTERI_PER_TOKEN = 4
+    # Stampa a console le statistiche di prestazione (prefill risparmiato, recupero RAG, ecc.).
+    LOG_PRESTAZIONI = False
+
+    # --- GUARDIA IN STREAMING (USCITE DAL PERSONAGGIO) ---
+    # Frasi inequivocabili di un assistente AI: se compaiono la generazione viene interrotta e ripetuta.
+    # Solo frasi che un personaggio non direbbe mai (un sospettato può dire "mi dispiace" o "non posso").
+    # Il confronto avviene su parole intere ("come ia" non intercetta "come Iacopo").
+    INDICATORI_ASSISTENTE_AI = ["language model", "modello linguistico", "as an ai", "come ia",
+                                "come intelligenza artificiale", "sono un'ia", "i'm an ai"]
+    # Elenco più ampio, usato solo sulla correzione chiesta dal Giudice: se la battuta corretta contiene
+    # anche solo delle scuse si mantiene la risposta iniziale, che resta comunque disponibile.
+    INDICATORI_FUORI_PERSONAGGIO = ["mi dispiace", "i'm sorry", "non posso"] + INDICATORI_ASSISTENTE_AI
+    # Lunghezza massima (in caratteri) di una battuta prima di considerarla fuori controllo.
+    MAX_CARATTERI_RISPOSTA = 1200
+    # Battuta usata quando non è possibile recuperare nessuna risposta valida.
+    RISPOSTA_DI_RIPIEGO = "*Il sospettato ti fissa in silenzio, senza rispondere.*"
+
+    # --- GENERAZIONE DEL CASO ---
+    # Numero di sospettati di una nuova partita (modificabile dal menu) e limiti ammessi.
+    NUM_SOSPETTATI = 3
+    MIN_SOSPETTATI = 3
+    MAX_SOSPETTATI = 20
+    # Generazioni dei singoli sospettati eseguite in parallelo (dopo lo Scheletro del caso).
+    MAX_GENERAZIONI_PARALLELE = 8
+
     # --- IMPOSTAZIONI RAG (Retrieval-Augmented Generation) ---
     # Prefisso per le collezioni nel database vettoriale per evitare collisioni tra NPC.
     RAG_COLLECTION_PREFIX = "investigazione_"
     # Top-K Retrieval: Numero massimo di "ricordi" (chunk) da recuperare per ogni query.
     # Tenuto basso (2) per evitare di inquinare il contesto con informazioni irrilevanti.
     MAX_RICORDI_RAG = 2
+    # Recupero adattivo: numero di candidati letti dal database prima di filtro, deduplicazione e budget.
+    RAG_CANDIDATI = 8
+    # Distanza massima (L2 al quadrato su embedding normalizzati: 0 = identico, 2 = ortogonale).
+    # I ricordi più lontani non vengono inseriti nel prompt. Da calibrare con le statistiche di recupero.
+    RAG_DISTANZA_MAX = 1.0
+    # Bilanciamento MMR (Maximal Marginal Relevance): 1.0 = solo rilevanza, 0.0 = solo diversità.
+    RAG_MMR_LAMBDA = 0.7
+    # Similarità (coseno) oltre la quale un candidato è considerato un duplicato di un ricordo già scelto.
+    RAG_SOGLIA_DUPLICATO = 0.95
+    # Budget massimo (token stimati) del contesto recuperato inserito nel prompt.
+    RAG_BUDGET_TOKEN = 300
+    # Collezioni con al massimo questi ricordi (es. i soli fatti forensi) vengono incluse per intero,
+    # senza calcolare l'embedding della domanda.
+    RAG_SOGLIA_COLLEZIONE_PICCOLA = 4
+    # Numero massimo di ricordi archiviati con una sola chiamata di embedding (scrittura Write-Behind).
+    RAG_BATCH_MAX = 16
+
+    # --- NARRAZIONE DINAMICA (COLPO DI SCENA) ---
+    # Numero di turni dopo il quale viene rivelato il colpo di scena.
+    SOGLIA_TURNI_COLPO_SCENA = 4
+    # Quanti turni prima della soglia iniziare a generare il colpo di scena in background.
+    ANTICIPO_COLPO_SCENA = 2
 
     # --- GESTIONE PERSISTENZA (FILE SYSTEM) ---
     # Directory dove verranno salvati i file JSON dello stato di gioco.
     SAVES_DIR = "salvataggi"
-    EXTENSION = ".json"
\ No newline at end of file
+    EXTENSION = ".json"
+
+    # --- SIMULAZIONE HEADLESS ---
+    # Directory dove la simulazione batch scrive i risultati (JSON Lines + riepilogo).
+    SIMULAZIONI_DIR = "simulazioni"
+    # Numero di casi eseguiti da un processo prima di essere riciclato (limita la crescita di memoria).
+    SIMULAZIONE_CASI_PER_PROCESSO = 50
+    # Processi worker di default: ognuno è una sessione concorrente verso lo stesso server Ollama.
+    # Va allineato a OLLAMA_NUM_PARALLEL: le richieste in coda sul server consumano il timeout di lettura
+    # e un sovraccarico produrrebbe casi falliti (risposte di ripiego) invece che più lenti.
+    SIMULAZIONE_PROCESSI = 2
+    # Quota massima di turni con risposta di ripiego (server in errore) oltre la quale un caso è scartato.
+    SIMULAZIONE_SOGLIA_RIPIEGHI = 0.2
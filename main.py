@@ -1,5 +1,8 @@
 import time
 from GameEngine import GameEngine
+from GestoreModelli import GestoreModelli
+from TrasportoOllama import trasporto
+from config import Config
 
 
 def main():
@@ -9,167 +12,149 @@ def main():
     loop di gioco principale e interazione utente.
     """
 
+    # Modalità di trasporto delle chiamate a Ollama (live / registrazione / riproduzione)
+    trasporto.configura()
+
     # Inizializzazione del motore di gioco
     engine = GameEngine()
 
-    # --- MENU PRINCIPALE ---
-    print("\n" + "═" * 40)
-    print("      NEURO-SYMBOLIC DETECTIVE      ")
-    print("═" * 40)
-    print("1. Nuova Indagine")
-    print("2. Carica Salvataggio")
-    print("-" * 40)
-
-    scelta = input("> ")
-
-    # --- GESTIONE MENU INIZIALE ---
-    if scelta == '2':
-        saves = engine.elenca_salvataggi()
-
-        if not saves:
-            print("\n[!] Nessun salvataggio trovato.")
-            print("Avvio nuova indagine...")
-            scelta = '1'
-        else:
-            print("\n[ ARCHIVIO CASI ]")
-            for i, file in enumerate(saves):
-                print(f"  {i + 1}. {file}")
-            print("  0. Indietro")
-
-            try:
-                idx = int(input("\nScegli file > "))
-                if 1 <= idx <= len(saves):
-                    filename_scelto = saves[idx - 1]
-                    print(f"\nRecupero fascicolo '{filename_scelto}'...")
-
-                    if engine.carica_partita(filename_scelto):
-                        print("Dati caricati con successo.")
+    # Warm-up dei modelli in background mentre il giocatore legge il menu
+    modelli = GestoreModelli()
+    modelli.avvia()
+
+    try:
+        # --- MENU PRINCIPALE ---
+        print("\n" + "═" * 40)
+        print("      NEURO-SYMBOLIC DETECTIVE      ")
+        print("═" * 40)
+        print("1. Nuova Indagine")
+        print("2. Carica Salvataggio")
+        print("-" * 40)
+
+        scelta = input("> ")
+
+        # Il warm-up rende più rapida la prima richiesta reale, ma non deve mai bloccare il gioco:
+        # l'attesa è limitata e, se il server è lento, si prosegue comunque
+        if not modelli.pronto():
+            print("\nCaricamento modelli in corso...")
+            modelli.attendi(Config.ATTESA_MAX_WARMUP)
+        print(f"[MODELLI] {modelli.stato()}")
+
+        # --- GESTIONE MENU INIZIALE ---
+        if scelta == '2':
+            saves = engine.elenca_salvataggi()
+
+            if not saves:
+                print("\n[!] Nessun salvataggio trovato.")
+                print("Avvio nuova indagine...")
+                scelta = '1'
+            else:
+                print("\n[ ARCHIVIO CASI ]")
+                for i, file in enumerate(saves):
+                    print(f"  {i + 1}. {file}")
+                print("  0. Indietro")
+
+                try:
+                    idx = int(input("\nScegli file > "))
+                    if 1 <= idx <= len(saves):
+                        filename_scelto = saves[idx - 1]
+                        print(f"\nRecupero fascicolo '{filename_scelto}'...")
+
+                        if engine.carica_partita(filename_scelto):
+                            print("Dati caricati con successo.")
+                        else:
+                            print("Errore nel caricamento.")
+                            return
                     else:
-                        print("Errore nel caricamento.")
-                        return
-                else:
+                        scelta = '1'
+                except ValueError:
                     scelta = '1'
-            except ValueError:
-                scelta = '1'
-
-    # --- GENERAZIONE NUOVA PARTITA ---
-    if scelta == '1':
-        if not engine.genera_nuova_partita():
-            print("Errore critico generazione.")
-            return
-
-    # --- INTRODUZIONE AL CASO ---
-    scen = engine.scenario
-
-    print("\n" + "-" * 50)
-    print(f" CASO APERTO: {scen['vittima'].upper()}")
-    print("-" * 50)
-
-    print(engine.genera_intro_narrativa())
-
-    print("\n[ RAPPORTO FORENSE ]")
-    for f in scen['rapporto_forense']:
-        print(f" • {f}")
-
-    # --- LOOP PRINCIPALE DEL GIOCO ---
-    while True:
-        # Mostra la lista dei sospettati in modo pulito
-        print("\n" + "-" * 30)
-        print(" SQUADRA SOSPETTATI & PISTE")
-        print("-" * 30)
-
-        for s in scen['sospettati']:
-            print(f" [{s['id']}] {s['nome'].upper()} | {s['ruolo']}")
-            print(f"      Pista: {s['indizio_iniziale']}")
-
-        print("-" * 30)
-        print("[OPZIONI]")
-        print("  S. Salva ed Esci")
-        print("  A. ACCUSA E RISOLVI IL CASO")
-
-        inp = input("\n> ").upper().strip()
-
-        # --- OPZIONE SALVATAGGIO ---
-        if inp == 'S':
-            print("\nNome salvataggio (Invio per nome auto):")
-            nome_user = input("> ").strip()
-            msg = engine.salva_partita(nome_user if nome_user else None)
-            print(f"\n>> {msg}")
-            break
-
-        # --- OPZIONE ACCUSA ---
-        elif inp == 'A':
-            print("\n" + "═" * 40)
-            print("      FASE FINALE: L'ACCUSA      ")
-            print("═" * 40)
-            print("Chi è il colpevole?")
 
+        # --- GENERAZIONE NUOVA PARTITA ---
+        if scelta == '1':
+            print(f"\nNumero di sospettati ({Config.MIN_SOSPETTATI}-{Config.MAX_SOSPETTATI}, Invio per {Config.NUM_SOSPETTATI}):")
             try:
-                id_accusa = int(input("ID sospettato > "))
-
-                sospettato_scelto = next((s for s in scen['sospettati'] if s['id'] == id_accusa), None)
-                vero_colpevole = next(s for s in scen['sospettati'] if s['colpevole'])
+                num_sospettati = int(input("> ").strip() or Config.NUM_SOSPETTATI)
+            except ValueError:
+                num_sospettati = Config.NUM_SOSPETTATI
+            num_sospettati = max(Config.MIN_SOSPETTATI, min(Config.MAX_SOSPETTATI, num_sospettati))
+
+            if not engine.genera_nuova_partita(num_sospettati):
+                print("Errore critico generazione.")
+                return
+
+        # --- INTRODUZIONE AL CASO ---
+        scen = engine.scenario
+
+        print("\n" + "-" * 50)
+        print(f" CASO APERTO: {scen['vittima'].upper()}")
+        print("-" * 50)
+
+        print(engine.genera_intro_narrativa())
+
+        print("\n[ RAPPORTO FORENSE ]")
+        for f in scen['rapporto_forense']:
+            print(f" • {f}")
+
+        # Dichiarazioni rese nei confronti di gruppo, incluse nel rapporto del successivo interrogatorio
+        dichiarazioni_confronto = {}
+
+        # --- LOOP PRINCIPALE DEL GIOCO ---
+        while True:
+            # Mostra la lista dei sospettati in modo pulito
+            print("\n" + "-" * 30)
+            print(" SQUADRA SOSPETTATI & PISTE")
+            print("-" * 30)
+
+            for s in scen['sospettati']:
+                print(f" [{s['id']}] {s['nome'].upper()} | {s['ruolo']}")
+                print(f"      Pista: {s['indizio_iniziale']}")
+
+            print("-" * 30)
+            print("[OPZIONI]")
+            print("  C. Confronto di gruppo")
+            print("  S. Salva ed Esci")
+            print("  A. ACCUSA E RISOLVI IL CASO")
+
+            inp = input("\n> ").upper().strip()
+
+            # --- OPZIONE SALVATAGGIO ---
+            if inp == 'S':
+                print("\nNome salvataggio (Invio per nome auto):")
+                nome_user = input("> ").strip()
+                msg = engine.salva_partita(nome_user if nome_user else None)
+                print(f"\n>> {msg}")
+                break
 
-                if not sospettato_scelto:
-                    print("[!] ID non valido.")
+            # --- OPZIONE CONFRONTO DI GRUPPO ---
+            elif inp == 'C':
+                print("\nID dei sospettati separati da virgola (Invio per tutti):")
+                scelta_ids = input("> ").strip()
+                ids_validi = [s['id'] for s in scen['sospettati']]
+                try:
+                    ids = [int(x) for x in scelta_ids.split(',')] if scelta_ids else ids_validi
+                except ValueError:
+                    print("[!] ID non validi.")
+                    continue
+                ids = [i for i in dict.fromkeys(ids) if i in ids_validi]
+                if len(ids) < 2:
+                    print("[!] Servono almeno due sospettati per un confronto.")
                     continue
 
-                print(f"\nEsecuzione mandato di arresto per {sospettato_scelto['nome']}...")
-                time.sleep(1)
-
-                if sospettato_scelto['colpevole']:
-                    print("\n[ ESITO: SUCCESSO ]")
-                    print(f"CASO RISOLTO. L'assassino era {vero_colpevole['nome']}.")
-                else:
-                    print(f"\n[ ESITO: FALLIMENTO ]")
-                    print(f"ERRORE GIUDIZIARIO. {sospettato_scelto['nome']} è INNOCENTE.")
-                    print(f"Il vero assassino era {vero_colpevole['nome']}.")
-
-                # Ground Truth formattata
-                print("\n" + "-" * 40)
-                print(" VERITÀ OGGETTIVA (GROUND TRUTH)")
-                print("-" * 40)
-                print(f" • Movente: {scen['movente_reale']}")
-                print(f" • Arma:    {scen['arma_reale']}")
-                print(f" • Alibi del Killer: FALSO ({vero_colpevole['alibi']})")
-                print(f" • Segreto: {vero_colpevole['segreto']}")
-                print("-" * 40)
-
-                break
-
-            except ValueError:
-                print("Inserire un numero valido.")
-
-        # --- OPZIONE INTERROGATORIO ---
-        elif inp.isdigit():
-            id_s = int(inp)
-            if 0 <= id_s < 3:
-                nome_sosp = scen['sospettati'][id_s]['nome']
-                print(f"\n--- SALA INTERROGATORI: {nome_sosp.upper()} ---")
+                nomi = {s['id']: s['nome'] for s in scen['sospettati']}
+                print(f"\n--- CONFRONTO: {', '.join(nomi[i].upper() for i in ids)} ---")
                 print("(Digita 'FINE' per terminare)")
 
-                history = []
                 while True:
                     d = input("\n[DETECTIVE]: ")
-
                     if d.upper() == 'FINE':
-                        if not history:
-                            break
-
-                        print("\nElaborazione rapporto analista in corso...")
-
-                        rapporto = engine.genera_rapporto_polizia(id_s, history)
-
-                        print("\n[ RAPPORTO ANALITICO ]")
-                        print(f"Soggetto: {nome_sosp.upper()}")
-                        print(f"Esito: {rapporto}")
-                        input("\n(Premi Invio per continuare)")
                         break
 
-                    # Elaborazione turno
-                    r = engine.elabora_turno(id_s, d, history)
-                    print(f"[SOSPETTATO]: {r}")
-                    history.append(f"Detective: {d} | Sospettato: {r}")
+                    # Le risposte arrivano nell'ordine in cui i sospettati finiscono di parlare
+                    for id_r, r in engine.elabora_confronto(ids, d):
+                        print(f"[{nomi[id_r].upper()}]: {r}")
+                        dichiarazioni_confronto.setdefault(id_r, []).append(
+                            f"Detective (confronto di gruppo): {d} | Sospettato: {r}")
 
                     # --- GESTIONE EVENTI (PLOT TWIST) ---
                     evento = engine.verifica_colpo_scena()
@@ -179,7 +164,97 @@ def main():
                         print(f" RAPPORTO URGENTE: {evento}")
                         print("-" * 60)
 
-                        time.sleep(2)
+            # --- OPZIONE ACCUSA ---
+            elif inp == 'A':
+                print("\n" + "═" * 40)
+                print("      FASE FINALE: L'ACCUSA      ")
+                print("═" * 40)
+                print("Chi è il colpevole?")
+
+                try:
+                    id_accusa = int(input("ID sospettato > "))
+
+                    sospettato_scelto = next((s for s in scen['sospettati'] if s['id'] == id_accusa), None)
+                    vero_colpevole = next(s for s in scen['sospettati'] if s['colpevole'])
+
+                    if not sospettato_scelto:
+                        print("[!] ID non valido.")
+                        continue
+
+                    print(f"\nEsecuzione mandato di arresto per {sospettato_scelto['nome']}...")
+                    time.sleep(1)
+
+                    if sospettato_scelto['colpevole']:
+                        print("\n[ ESITO: SUCCESSO ]")
+                        print(f"CASO RISOLTO. L'assassino era {vero_colpevole['nome']}.")
+                    else:
+                        print(f"\n[ ESITO: FALLIMENTO ]")
+                        print(f"ERRORE GIUDIZIARIO. {sospettato_scelto['nome']} è INNOCENTE.")
+                        print(f"Il vero assassino era {vero_colpevole['nome']}.")
+
+                    # Ground Truth formattata
+                    print("\n" + "-" * 40)
+                    print(" VERITÀ OGGETTIVA (GROUND TRUTH)")
+                    print("-" * 40)
+                    print(f" • Movente: {scen['movente_reale']}")
+                    print(f" • Arma:    {scen['arma_reale']}")
+                    print(f" • Alibi del Killer: FALSO ({vero_colpevole['alibi']})")
+                    print(f" • Segreto: {vero_colpevole['segreto']}")
+                    print("-" * 40)
+
+                    break
+
+                except ValueError:
+                    print("Inserire un numero valido.")
+
+            # --- OPZIONE INTERROGATORIO ---
+            elif inp.isdigit():
+                id_s = int(inp)
+                sospettato_sel = next((s for s in scen['sospettati'] if s['id'] == id_s), None)
+                if sospettato_sel:
+                    nome_sosp = sospettato_sel['nome']
+                    print(f"\n--- SALA INTERROGATORI: {nome_sosp.upper()} ---")
+                    print("(Digita 'FINE' per terminare)")
+
+                    history = []
+                    while True:
+                        d = input("\n[DETECTIVE]: ")
+
+                        if d.upper() == 'FINE':
+                            # Il rapporto include anche le dichiarazioni rese nei confronti di gruppo
+                            trascrizione = dichiarazioni_confronto.pop(id_s, []) + history
+                            if not trascrizione:
+                                break
+
+                            print("\nElaborazione rapporto analista in corso...")
+
+                            rapporto = engine.genera_rapporto_polizia(id_s, trascrizione)
+
+                            print("\n[ RAPPORTO ANALITICO ]")
+                            print(f"Soggetto: {nome_sosp.upper()}")
+                            print(f"Esito: {rapporto}")
+                            input("\n(Premi Invio per continuare)")
+                            break
+
+                        # Elaborazione turno
+                        r = engine.elabora_turno(id_s, d)
+                        print(f"[SOSPETTATO]: {r}")
+                        history.append(f"Detective: {d} | Sospettato: {r}")
+
+                        # --- GESTIONE EVENTI (PLOT TWIST) ---
+                        evento = engine.verifica_colpo_scena()
+                        if evento:
+                            print(" [!] AGGIORNAMENTO DALLA CENTRALE")
+                            print("-" * 60)
+                            print(f" RAPPORTO URGENTE: {evento}")
+                            print("-" * 60)
+    finally:
+        # Chiusura garantita anche in caso di errore o Ctrl+C: la cassetta in registrazione resta valida
+        engine.chiudi()
+        trasporto.chiudi()
+
+    if Config.SCARICA_MODELLI_ALL_USCITA:
+        modelli.rilascia()
 
     engine.apri_questionario()
 
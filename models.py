@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import List
 
 
@@ -30,6 +30,52 @@ class Sospettato(BaseModel):
                                   description="Il motivo specifico per cui è sospettato (es. 'Visto litigare', 'Le sue impronte sono sulla porta', 'Era l'unico con le chiavi')")
 
 
+class DettagliSospettato(BaseModel):
+    """
+    Output della generazione 'per sospettato' (Sub-Generation).
+    Contiene solo i campi narrativi: id, ruolo e colpevolezza sono decisi dallo Scheletro del caso.
+    Il nome viene ripetuto dall'LLM e confrontato con quello dello Scheletro per validare la coerenza.
+    """
+    nome: str = Field(..., description="Nome e cognome del sospettato (identico a quello assegnato)")
+    personalita: str = Field(..., description="Aggettivo forte che definisce come parla")
+    alibi: str = Field(..., description="L'alibi fornito (falso se colpevole, vero se innocente)")
+    segreto: str = Field(..., description="Un segreto oscuro o un dettaglio sospetto")
+    indizio_iniziale: str = Field(..., description="Il motivo specifico per cui è sospettato")
+
+
+class PersonaggioCast(BaseModel):
+    """Voce del 'cast' dello Scheletro: identità di un sospettato prima della generazione dei dettagli."""
+    nome: str = Field(..., description="Nome e cognome del sospettato")
+    ruolo: str = Field(..., description="Il mestiere o ruolo sociale")
+
+
+class ScheletroCaso(BaseModel):
+    """
+    Modello dello 'Scheletro' del caso: i fatti globali (vittima, arma, movente, prove),
+    l'elenco dei sospettati e la scelta del colpevole.
+    Viene generato con una chiamata breve, prima delle generazioni parallele dei singoli sospettati.
+    """
+    vittima: str = Field(..., description="Nome della vittima")
+    luogo_omicidio: str = Field(..., description="Ambientazione noir dettagliata")
+    arma_reale: str = Field(..., description="L'oggetto usato per l'omicidio")
+    movente_reale: str = Field(..., description="Il motivo profondo dell'omicidio")
+    intro_atmosfera: str = Field(..., description="Descrizione sensoriale del meteo e luci")
+    rapporto_forense: List[str] = Field(..., description="Lista di 3 fatti oggettivi e scientifici trovati sulla scena")
+    cast: List[PersonaggioCast] = Field(..., description="Nomi e ruoli di tutti i sospettati")
+    indice_colpevole: int = Field(..., description="Posizione del colpevole nella lista 'cast' (da 0)")
+
+    @model_validator(mode='after')
+    def verifica_coerenza(self):
+        nomi = [p.nome.strip().lower() for p in self.cast]
+        if len(set(nomi)) != len(nomi):
+            raise ValueError("I nomi dei sospettati devono essere tutti diversi")
+        if self.vittima.strip().lower() in nomi:
+            raise ValueError("La vittima non può essere tra i sospettati")
+        if not 0 <= self.indice_colpevole < len(self.cast):
+            raise ValueError("indice_colpevole fuori dall'elenco dei sospettati")
+        return self
+
+
 class ScenarioInvestigativo(BaseModel):
     """
     Modello 'Root' (Radice) che incapsula l'intero stato narrativo di una partita.
@@ -44,5 +90,13 @@ class ScenarioInvestigativo(BaseModel):
     # Lista di stringhe che verranno usate per costruire i nodi 'PROVA' nel Knowledge Graph
     rapporto_forense: List[str] = Field(..., description="Lista di 3 fatti oggettivi e scientifici trovati sulla scena")
 
-    # Relazione 1-a-Molti: Uno scenario contiene esattamente 3 sospettati strutturati
-    sospettati: List[Sospettato] = Field(..., description="Lista esattamente di 3 sospettati")
\ No newline at end of file
+    # Relazione 1-a-Molti: Uno scenario contiene N sospettati strutturati (Config.NUM_SOSPETTATI)
+    sospettati: List[Sospettato] = Field(..., description="Lista dei sospettati, di cui esattamente uno colpevole")
+
+    @model_validator(mode='after')
+    def verifica_sospettati(self):
+        if sum(s.colpevole for s in self.sospettati) != 1:
+            raise ValueError("Deve esserci esattamente un colpevole")
+        if len({s.id for s in self.sospettati}) != len(self.sospettati):
+            raise ValueError("Gli id dei sospettati devono essere univoci")
+        return self
\ No newline at end of file
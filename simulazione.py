@@ -0,0 +1,298 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from config import Config
+from GameEngine import GameEngine
+from TrasportoOllama import trasporto
+
+
+# --- POLITICHE DEL DETECTIVE ---
+# Una politica decide le domande da porre a ogni sospettato e chi accusare alla fine.
+# Interagisce col gioco solo tramite l'API pubblica del GameEngine (come farebbe main.py).
+
+class PoliticaScriptata:
+    """
+    Detective deterministico: pone a ogni sospettato le stesse domande standard
+    (alibi, rapporto con la vittima, arma, indizio iniziale) e accusa chi ha mostrato
+    più tic comportamentali (*...*), il 'tell' che il prompt impone al colpevole quando mente.
+    """
+    nome = "scriptata"
+
+    DOMANDE = [
+        "Dove si trovava al momento del delitto?",
+        "Che rapporto aveva con {vittima}?",
+        "Cosa sa dell'arma del delitto, {arma}?",
+        "Mi risulta questo: {indizio}. Come lo spiega?",
+    ]
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def prossima_domanda(self, scenario, sospettato, trascrizione):
+        modello = self.DOMANDE[len(trascrizione) % len(self.DOMANDE)]
+        return modello.format(vittima=scenario['vittima'], arma=scenario['arma_reale'],
+                              indizio=sospettato['indizio_iniziale'])
+
+    def accusa(self, scenario, trascrizioni):
+        # La risposta di ripiego (generazione fallita) è scritta tra asterischi ma non è un 'tell'
+        punteggi = {id_s: sum(len(re.findall(r"\*[^*]+\*", r)) for _, r in righe if r != Config.RISPOSTA_DI_RIPIEGO)
+                    for id_s, righe in trascrizioni.items()}
+        massimo = max(punteggi.values())
+        # A parità di punteggio la scelta è casuale (ma riproducibile grazie al seme)
+        return self.rng.choice([id_s for id_s, p in punteggi.items() if p == massimo])
+
+
+class PoliticaLLM(PoliticaScriptata):
+    """
+    Detective guidato dall'LLM: genera ogni domanda a partire dalla trascrizione
+    e sceglie il colpevole leggendo tutti gli interrogatori.
+    In caso di errore ricade sul comportamento della politica scriptata.
+    """
+    nome = "llm"
+
+    def prossima_domanda(self, scenario, sospettato, trascrizione):
+        storia = "\n".join(f"Detective: {d} | Sospettato: {r}" for d, r in trascrizione) or "(nessuna)"
+        prompt = f"""
+        Sei un detective che interroga {sospettato['nome']} ({sospettato['ruolo']})
+        sull'omicidio di {scenario['vittima']} ({scenario['arma_reale']}).
+        Indizio iniziale: {sospettato['indizio_iniziale']}
+        Fatti noti: {", ".join(scenario['rapporto_forense'])}
+
+        Interrogatorio finora:
+        {storia}
+
+        Scrivi SOLO la prossima domanda da porre (una frase).
+        """
+        try:
+            res = trasporto.chat(model=Config.MODEL_NAME, messages=[{'role': 'user', 'content': prompt}],
+                                 options={'temperature': Config.TEMPERATURE_CREATIVA}, keep_alive=Config.KEEP_ALIVE)
+            domanda = res['message']['content'].strip().strip('"')
+            if domanda:
+                return domanda
+        except Exception:
+            pass
+        return super().prossima_domanda(scenario, sospettato, trascrizione)
+
+    def accusa(self, scenario, trascrizioni):
+        blocchi = []
+        for s in scenario['sospettati']:
+            righe = "\n".join(f"Detective: {d} | Sospettato: {r}" for d, r in trascrizioni.get(s['id'], []))
+            blocchi.append(f"[ID {s['id']}] {s['nome']} ({s['ruolo']})\n{righe}")
+        interrogatori = "\n\n".join(blocchi)
+
+        prompt = f"""
+        Sei un detective. Omicidio di {scenario['vittima']}.
+        Fatti noti: {", ".join(scenario['rapporto_forense'])}
+
+        INTERROGATORI:
+        {interrogatori}
+
+        Chi è il colpevole? Rispondi SOLO col JSON: {{"id_colpevole": <numero>}}
+        """
+        try:
+            res = trasporto.chat(model=Config.MODEL_NAME, messages=[{'role': 'user', 'content': prompt}],
+                                 format='json', options={'temperature': Config.TEMPERATURE_LOGICA},
+                                 keep_alive=Config.KEEP_ALIVE)
+            id_colpevole = int(json.loads(res['message']['content'])['id_colpevole'])
+            if id_colpevole in trascrizioni:
+                return id_colpevole
+        except Exception:
+            pass
+        return super().accusa(scenario, trascrizioni)
+
+
+POLITICHE = {PoliticaScriptata.nome: PoliticaScriptata, PoliticaLLM.nome: PoliticaLLM}
+
+
+# --- ESECUZIONE DI UN SINGOLO CASO (nel processo worker) ---
+
+def _percentile(valori, p):
+    if not valori:
+        return None
+    ordinati = sorted(valori)
+    return ordinati[min(len(ordinati) - 1, int(round(p * (len(ordinati) - 1))))]
+
+
+def esegui_caso(indice, nome_politica, num_domande, seme, verboso=False, modalita="live", cartella_cassette=None,
+                istantaneo=False, num_sospettati=None):
+    """
+    Gioca una partita completa senza interazione umana e restituisce un dizionario di risultati.
+    Nessuna chiamata a input(), time.sleep() o webbrowser: si usa solo l'API del GameEngine.
+    Con modalita 'registra'/'riproduci' ogni caso usa la propria cassetta nella cartella indicata.
+    """
+    risultato = {'caso': indice, 'politica': nome_politica, 'seme': seme + indice, 'errore': None}
+    percorso = os.path.join(cartella_cassette, f"caso_{indice}.jsonl.gz") if cartella_cassette else None
+    rng = random.Random(seme + indice)
+    politica = POLITICHE[nome_politica](rng)
+
+    # L'output del motore (print di debug) viene soppresso, salvo richiesta esplicita
+    uscita = contextlib.nullcontext() if verboso else contextlib.redirect_stdout(io.StringIO())
+    engine = None
+    with uscita:
+        try:
+            # I processi worker non ereditano la configurazione del padre: il trasporto va impostato qui
+            # (una cassetta mancante o illeggibile diventa l'errore del caso, non del batch)
+            trasporto.configura(modalita, percorso, istantaneo)
+            engine = GameEngine()
+
+            inizio = time.perf_counter()
+            if not engine.genera_nuova_partita(num_sospettati):
+                risultato['errore'] = "Generazione scenario fallita"
+                return risultato
+            risultato['tempo_generazione'] = time.perf_counter() - inizio
+
+            scenario = engine.scenario
+            latenze = []
+            trascrizioni = {}
+            sospettati = list(scenario['sospettati'])
+            rng.shuffle(sospettati)  # L'ordine degli interrogatori influisce sul colpo di scena
+
+            for s in sospettati:
+                righe = trascrizioni.setdefault(s['id'], [])
+                for _ in range(num_domande):
+                    domanda = politica.prossima_domanda(scenario, s, righe)
+                    t0 = time.perf_counter()
+                    risposta = engine.elabora_turno(s['id'], domanda)
+                    latenze.append(time.perf_counter() - t0)
+                    righe.append((domanda, risposta))
+                    engine.verifica_colpo_scena()
+
+            id_accusato = politica.accusa(scenario, trascrizioni)
+            id_colpevole = next(s['id'] for s in scenario['sospettati'] if s['colpevole'])
+
+            verifiche = engine.metriche['verifiche']
+            ripieghi = engine.metriche['risposte_ripiego']
+            risultato.update({
+                'num_sospettati': len(scenario['sospettati']),
+                'id_accusato': id_accusato,
+                'id_colpevole': id_colpevole,
+                'corretto': id_accusato == id_colpevole,
+                'turni': engine.turni_giocati,
+                'verifiche': verifiche,
+                'correzioni': engine.metriche['correzioni'],
+                'fallback_ai': engine.metriche['fallback_ai'],
+                'interruzioni': engine.metriche['interruzioni'],
+                'risposte_ripiego': ripieghi,
+                'verifiche_saltate': engine.metriche['verifiche_saltate'],
+                'correzioni_saltate': engine.metriche['correzioni_saltate'],
+                'tasso_correzione': engine.metriche['correzioni'] / verifiche if verifiche else 0.0,
+                'colpo_scena': engine.evento_avvenuto,
+                'latenze_turno': latenze,
+                'latenza_media': sum(latenze) / len(latenze) if latenze else None,
+                'latenza_p95': _percentile(latenze, 0.95),
+            })
+            # Con troppi turni senza risposta (server in errore) accusa e metriche non sono significative
+            if latenze and ripieghi / len(latenze) > Config.SIMULAZIONE_SOGLIA_RIPIEGHI:
+                risultato['errore'] = f"Troppe risposte di ripiego ({ripieghi}/{len(latenze)} turni)"
+        except Exception as e:
+            risultato['errore'] = f"{type(e).__name__}: {e}"
+        finally:
+            # Ferma i worker delle memorie: un processo esegue molti casi in sequenza
+            if engine is not None:
+                engine.chiudi()
+            trasporto.chiudi()
+    return risultato
+
+
+# --- ORCHESTRAZIONE (processo principale) ---
+
+def riepiloga(risultati, durata):
+    """Aggrega i risultati dei singoli casi in statistiche globali."""
+    validi = [r for r in risultati if not r['errore']]
+    latenze = [l for r in validi for l in r['latenze_turno']]
+    verifiche = sum(r['verifiche'] for r in validi)
+    return {
+        'casi_totali': len(risultati),
+        'casi_validi': len(validi),
+        'casi_falliti': len(risultati) - len(validi),
+        # Chiamate fallite su tutti i casi (anche quelli scartati): misurano la salute del server
+        'risposte_ripiego': sum(r.get('risposte_ripiego', 0) for r in risultati),
+        'verifiche_saltate': sum(r.get('verifiche_saltate', 0) for r in risultati),
+        'correzioni_saltate': sum(r.get('correzioni_saltate', 0) for r in risultati),
+        'accuratezza_accuse': sum(r['corretto'] for r in validi) / len(validi) if validi else None,
+        'tasso_correzione': sum(r['correzioni'] for r in validi) / verifiche if verifiche else None,
+        'turni_medi': sum(r['turni'] for r in validi) / len(validi) if validi else None,
+        'latenza_turno_media': sum(latenze) / len(latenze) if latenze else None,
+        'latenza_turno_p50': _percentile(latenze, 0.50),
+        'latenza_turno_p95': _percentile(latenze, 0.95),
+        'tempo_generazione_medio': sum(r['tempo_generazione'] for r in validi) / len(validi) if validi else None,
+        'durata_totale_s': durata,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulazione headless di partite investigative (batch).")
+    parser.add_argument("-n", "--partite", type=int, default=10, help="Numero di casi da simulare")
+    parser.add_argument("-p", "--processi", type=int, default=Config.SIMULAZIONE_PROCESSI,
+                        help="Numero di processi worker (da allineare a OLLAMA_NUM_PARALLEL del server)")
+    parser.add_argument("--politica", choices=sorted(POLITICHE), default=PoliticaScriptata.nome,
+                        help="Politica del detective")
+    parser.add_argument("--domande", type=int, default=3, help="Domande per ogni sospettato")
+    parser.add_argument("--sospettati", type=int, default=Config.NUM_SOSPETTATI,
+                        help=f"Sospettati per caso ({Config.MIN_SOSPETTATI}-{Config.MAX_SOSPETTATI})")
+    parser.add_argument("--seme", type=int, default=0, help="Seme per la riproducibilità delle scelte casuali")
+    parser.add_argument("--output", default=None, help="File JSON Lines dei risultati")
+    parser.add_argument("--verboso", action="store_true", help="Mostra l'output del motore di gioco")
+    parser.add_argument("--modalita", choices=("live", "registra", "riproduci"), default="live",
+                        help="Trasporto delle chiamate a Ollama (registrazione/riproduzione su cassette)")
+    parser.add_argument("--cassette", default=os.path.join(Config.SIMULAZIONI_DIR, "cassette"),
+                        help="Cartella delle cassette (una per caso)")
+    parser.add_argument("--istantaneo", action="store_true",
+                        help="In riproduzione restituisce le risposte senza rispettare i tempi originali")
+    args = parser.parse_args()
+
+    if not os.path.exists(Config.SIMULAZIONI_DIR):
+        os.makedirs(Config.SIMULAZIONI_DIR)
+    output = args.output or os.path.join(
+        Config.SIMULAZIONI_DIR, f"simulazione_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.jsonl")
+
+    print(f"Simulazione di {args.partite} casi ({args.politica}) su {args.processi} processi -> {output}")
+
+    risultati = []
+    inizio = time.perf_counter()
+    # 'spawn' evita di ereditare thread e stato di ChromaDB dal processo padre;
+    # i worker vengono riciclati periodicamente per contenere la memoria nelle esecuzioni lunghe.
+    contesto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.processi, mp_context=contesto,
+                             max_tasks_per_child=Config.SIMULAZIONE_CASI_PER_PROCESSO) as pool, \
+            open(output, 'w') as f:
+        futuri = {pool.submit(esegui_caso, i, args.politica, args.domande, args.seme, args.verboso,
+                              args.modalita, args.cassette, args.istantaneo, args.sospettati): i
+                  for i in range(args.partite)}
+        for futuro in as_completed(futuri):
+            try:
+                r = futuro.result()
+            except Exception as e:
+                # Worker terminato (es. memoria esaurita, crash di ChromaDB): il caso è registrato come errore
+                # e il batch prosegue con gli altri
+                i = futuri[futuro]
+                r = {'caso': i, 'politica': args.politica, 'seme': args.seme + i,
+                     'errore': f"{type(e).__name__}: {e}"}
+            risultati.append(r)
+            # Scrittura incrementale: un'interruzione notturna non perde i casi già completati
+            f.write(json.dumps(r) + "\n")
+            f.flush()
+            esito = r['errore'] or ("CORRETTO" if r['corretto'] else "ERRATO")
+            print(f"[{len(risultati)}/{args.partite}] Caso {r['caso']}: {esito}")
+
+    riepilogo = riepiloga(risultati, time.perf_counter() - inizio)
+    percorso_riepilogo = os.path.splitext(output)[0] + "_riepilogo.json"
+    with open(percorso_riepilogo, 'w') as f:
+        json.dump(riepilogo, f, indent=2)
+
+    print("\n[ RIEPILOGO ]")
+    for chiave, valore in riepilogo.items():
+        print(f" • {chiave}: {valore}")
+
+
+if __name__ == "__main__":
+    main()